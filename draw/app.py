@@ -1,12 +1,17 @@
 # pip install Flask
-# pdf to png requires ghostscript `pdftoppm` and ImageMagick `convert`
+# pdf to png requires PyMuPDF (pip install pymupdf) or poppler `pdftoppm`
 import base64
+import collections
+import concurrent.futures
+import hashlib
+import hmac
 import io
 import json
 import logging
+import math
 import os
-import sqlite3
-import subprocess
+import struct
+import threading
 import time
 
 from flask import Flask, render_template, request, g, url_for
@@ -17,6 +22,11 @@ memcache = None
 from . import cache
 from . import demorace
 from . import draw
+from . import instrument
+from . import metrics
+from . import patch
+from . import raster
+from . import sqlpool
 ElectionPrinter = draw.ElectionPrinter
 
 app = Flask(__name__, template_folder=os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../templates')))
@@ -31,6 +41,68 @@ if (os.getenv('SERVER_SOFTWARE') or '').startswith('gunicorn') and (__name__ !=
 draw.logger = app.logger
 
 _cache = None
+# concurrent renders of the same render_key() wait on one render
+_render_flights = cache.SingleFlight()
+
+# rendered artifacts are content addressed, so they don't go stale, only cold
+RENDER_CACHE_TTL = int(os.getenv('BALLOTSTUDIO_RENDER_CACHE_TTL') or (24*3600))
+# seconds past RENDER_CACHE_TTL that a render may still be served. Serving it keeps it another RENDER_CACHE_TTL.
+RENDER_CACHE_STALE = int(os.getenv('BALLOTSTUDIO_RENDER_CACHE_STALE') or 0)
+# threads rendering saved elections in the background
+RENDER_WORKERS = int(os.getenv('BALLOTSTUDIO_RENDER_WORKERS') or 2)
+# seconds a failed background render is reported by /render/<job>, and how many are kept
+RENDER_ERROR_TTL = int(os.getenv('BALLOTSTUDIO_RENDER_ERROR_TTL') or 3600)
+RENDER_ERRORS_MAX = 1000
+# limit for local built in cache
+CACHE_MAXBYTES = int(os.getenv('BALLOTSTUDIO_CACHE_MAXBYTES') or (512*1024*1024))
+# PATCHes are logged; after this many the stored election is rewritten whole and the log cleared
+PATCH_LOG_MAX = int(os.getenv('BALLOTSTUDIO_PATCH_LOG_MAX') or 100)
+# parsed elections kept in memory by (itemid, revision)
+PARSED_ELECTIONS = int(os.getenv('BALLOTSTUDIO_PARSED_ELECTIONS') or 32)
+# same election, same PDF bytes. ballots show the report's GeneratedDate instead of the time drawn.
+if os.getenv('BALLOTSTUDIO_DETERMINISTIC'):
+    draw.gs.deterministic = True
+
+# in-process numbers for GET /metrics
+_metrics = metrics.Registry()
+request_seconds = _metrics.histogram('ballotstudio_request_seconds', 'request latency by route', ('route', 'method'))
+requests_total = _metrics.counter('ballotstudio_requests_total', 'requests by route and status', ('route', 'method', 'status'))
+render_seconds = _metrics.histogram('ballotstudio_render_seconds', 'time to draw a whole election')
+renders_total = _metrics.counter('ballotstudio_renders_total', 'elections drawn')
+styles_total = _metrics.counter('ballotstudio_styles_drawn_total', 'ballot styles drawn')
+pages_total = _metrics.counter('ballotstudio_pages_drawn_total', 'pages drawn')
+raster_seconds = _metrics.histogram('ballotstudio_raster_seconds', 'time to rasterize one page to PNG', ('method',))
+sqlite_seconds = _metrics.histogram('ballotstudio_sqlite_seconds', 'election storage calls', ('op',))
+
+@_metrics.collector
+def _cache_metrics():
+    c = _cache
+    if c is None or not hasattr(c, 'stats'):
+        return []
+    st = c.stats()
+    return [
+        ('ballotstudio_cache_hits_total', 'counter', 'render cache hits', st['hits']),
+        ('ballotstudio_cache_misses_total', 'counter', 'render cache misses', st['misses']),
+        ('ballotstudio_cache_evictions_total', 'counter', 'render cache items evicted to stay under maxbytes', st['evictions']),
+        ('ballotstudio_cache_expirations_total', 'counter', 'render cache items dropped at their ttl', st['expirations']),
+        ('ballotstudio_cache_items', 'gauge', 'render cache items', st['items']),
+        ('ballotstudio_cache_bytes', 'gauge', 'render cache approximate bytes', st['bytes']),
+        ('ballotstudio_cache_max_bytes', 'gauge', 'render cache limit', st['maxbytes'] or 0),
+    ]
+
+def _sqlite(op, fn, *args):
+    start = time.perf_counter()
+    try:
+        with instrument.phase('sqlite'):
+            return fn(*args)
+    finally:
+        sqlite_seconds.observe(time.perf_counter() - start, op)
+
+# GET /debug/profile is off unless this is set; requests need "Authorization: Bearer <token>"
+DEBUG_TOKEN = os.getenv('BALLOTSTUDIO_DEBUG_TOKEN')
+PROFILE_MAX_SECONDS = 300
+# one profile at a time per process
+_profile_lock = threading.Lock()
 
 def mc():
     # use memcached if installed?
@@ -42,111 +114,365 @@ def mc():
     # use local built in cache
     global _cache
     if _cache is None:
-        _cache = cache.Cache()
+        _cache = cache.Cache(maxbytes=CACHE_MAXBYTES)
     return _cache
 
+def cache_get(key):
+    with instrument.phase('cache'):
+        return mc().get(key)
+
+def cache_set(key, value, time=None):
+    "time: seconds to keep value, None for no expiry"
+    with instrument.phase('cache'):
+        if time is None:
+            # memcache never expires 0, local Cache never expires None
+            time = 0 if memcache is not None else None
+        return mc().set(key, value, time=time)
+
 # TODO: ownership, ACLs, any kind of security at all
 current_schema = [
-    "CREATE TABLE IF NOT EXISTS elections (data TEXT, meta TEXT)", # use builtin ROWID
+    # revision counts every change. data is the election at revision minus the patches logged since.
+    "CREATE TABLE IF NOT EXISTS elections (data TEXT, meta TEXT, revision INTEGER NOT NULL DEFAULT 1)", # use builtin ROWID
     "CREATE TABLE IF NOT EXISTS migrations (mid INT PRIMARY KEY) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS election_patches (itemid INTEGER, revision INTEGER, patch TEXT, PRIMARY KEY (itemid, revision)) WITHOUT ROWID",
 ]
 
 # never delete a migration or change its int key
 migrations = [
-    (1, ["CREATE TABLE IF NOT EXISTS migrations (mid INT PRIMARY KEY) WITHOUT ROWID","ALTER TABLE elections ADD COLUMN meta TEXT"])
+    (1, ["CREATE TABLE IF NOT EXISTS migrations (mid INT PRIMARY KEY) WITHOUT ROWID","ALTER TABLE elections ADD COLUMN meta TEXT"]),
+    (2, ["ALTER TABLE elections ADD COLUMN revision INTEGER NOT NULL DEFAULT 1", "CREATE TABLE IF NOT EXISTS election_patches (itemid INTEGER, revision INTEGER, patch TEXT, PRIMARY KEY (itemid, revision)) WITHOUT ROWID"]),
 ]
 
+# prepared statements are cached per connection by sqlite3, keyed by exact sql text
+_election_select_sql = "SELECT data FROM elections WHERE ROWID = ?"
+_election_revision_sql = "SELECT revision FROM elections WHERE ROWID = ?"
+# TODO: why isn't sqlite "ON CONFLICT ..." syntax working? sqlite3.sqlite_version === '3.22.0'
+#_election_upsert_sql = "INSERT INTO elections (ROWID, data) VALUES (?, ?) ON CONFLICT (ROWID) DO UPDATE SET data = EXCLUDED.data"
+_election_update_sql = "UPDATE elections SET data = ?, revision = revision + 1 WHERE ROWID = ?"
+_election_insert_id_sql = "INSERT INTO elections (ROWID, data) VALUES (?, ?)"
+_election_insert_sql = "INSERT INTO elections (data) VALUES (?)"
+_election_set_revision_sql = "UPDATE elections SET revision = ? WHERE ROWID = ?"
+_election_compact_sql = "UPDATE elections SET data = ?, revision = ? WHERE ROWID = ?"
+_patches_select_sql = "SELECT patch FROM election_patches WHERE itemid = ? ORDER BY revision"
+_patches_count_sql = "SELECT COUNT(*) FROM election_patches WHERE itemid = ?"
+_patches_insert_sql = "INSERT INTO election_patches (itemid, revision, patch) VALUES (?, ?, ?)"
+_patches_delete_sql = "DELETE FROM election_patches WHERE itemid = ?"
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+# sqlite paths already set up by this process or a parent it forked from
+_db_setup_done = set()
+
+def _setup_db(conn):
+    "schema, migrations, WAL mode and demo election. once per process."
+    c = conn.cursor()
+    c.execute("PRAGMA journal_mode=WAL")
+    # lock out other processes doing the same setup
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute("SELECT mid FROM migrations")
+        migrations_done = set([row[0] for row in c.fetchall()])
+    except:
+        migrations_done = set()
+    try:
+        c.execute("SELECT COUNT(*) FROM elections")
+        row = c.fetchone()
+        num_elections = row and row[0]
+    except:
+        num_elections = 0
+    if not num_elections:
+        # new db
+        for stmt in current_schema:
+            c.execute(stmt)
+        # mark all migrations as applied
+        c.executemany("INSERT OR IGNORE INTO migrations (mid) VALUES (?)", [(mig[0],) for mig in migrations])
+    else:
+        migs_applied = []
+        for mig in migrations:
+            mid = mig[0]
+            if mid not in migrations_done:
+                for stmt in mig[1]:
+                    c.execute(stmt)
+                migs_applied.append( (mid,) )
+        c.executemany("INSERT INTO migrations (mid) VALUES (?)", migs_applied)
+    conn.commit()
+    c.close()
+    demo, _ = _getelection(1, conn)
+    if not demo:
+        _putelection(demorace.ElectionReport, 1, conn)
+
+def dbpool():
+    global _db_pool
+    pool = _db_pool
+    if (pool is not None) and (pool.pid == os.getpid()):
+        return pool
+    with _db_pool_lock:
+        if (_db_pool is None) or (_db_pool.pid != os.getpid()):
+            # new process, don't touch connections inherited across fork
+            sqlite3path = os.getenv('BALLOTSTUDIO_SQLITE') or 'ballotstudio.sqlite'
+            pool = sqlpool.ConnectionPool(sqlite3path, size=int(os.getenv('BALLOTSTUDIO_SQLITE_POOL') or 8))
+            if sqlite3path not in _db_setup_done:
+                conn = pool.get()
+                try:
+                    _setup_db(conn)
+                finally:
+                    pool.put(conn)
+                _db_setup_done.add(sqlite3path)
+            _db_pool = pool
+        return _db_pool
+
 def db():
     conn = getattr(g, '_database', None)
     if conn is None:
-        sqlite3path = os.getenv('BALLOTSTUDIO_SQLITE') or 'ballotstudio.sqlite'
-        conn = sqlite3.connect(sqlite3path)
-        c = conn.cursor()
-        try:
-            c.execute("SELECT mid FROM migrations")
-            migrations_done = set([row[0] for row in c.fetchall()])
-        except:
-            migrations_done = set()
-        try:
-            c.execute("SELECT COUNT(*) FROM elections")
-            row = c.fetchone()
-            num_elections = row and row[0]
-        except:
-            num_elections = 0
-        if not num_elections:
-            # new db
-            for stmt in current_schema:
-                c.execute(stmt)
-            # mark all migrations as applied
-            c.executemany("INSERT INTO migrations (mid) VALUES (?)", [(mig[0],) for mig in migrations])
-        else:
-            migs_applied = []
-            for mig in migrations:
-                mid = mig[0]
-                if mid not in migrations_done:
-                    for stmt in mig[1]:
-                        c.execute(stmt)
-                    migs_applied.append( (mid,) )
-            c.executemany("INSERT INTO migrations (mid) VALUES (?)", migs_applied)
-        conn.commit()
-        demo = _getelection(1, conn)
-        if not demo:
-            _putelection(demorace.ElectionReport, 1, conn)
+        conn = dbpool().get()
         g._database = conn
     return conn
 
+@app.teardown_appcontext
+def _db_release(exc):
+    conn = g.pop('_database', None)
+    if conn is not None:
+        dbpool().put(conn)
+
+# a json line per request: route, status, time, styles and pages drawn, time per phase
+access_logger = app.logger.getChild('access')
+
+def _request_json():
+    with instrument.phase('parse'):
+        return request.get_json()
+
+@app.before_request
+def _timings_start():
+    g._request_start = time.perf_counter()
+    instrument.timingsStart()
+
+@app.after_request
+def _timings_report(response):
+    t = instrument.timingsStop()
+    if t is None:
+        return response
+    total = time.perf_counter() - g._request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_seconds.observe(total, route, request.method)
+    requests_total.inc(route, request.method, response.status_code)
+    phases = ['{};dur={:.1f}'.format(name, sec * 1000) for name, sec in t.seconds.items()]
+    phases.append('total;dur={:.1f}'.format(total * 1000))
+    response.headers['Server-Timing'] = ', '.join(phases)
+    if access_logger.isEnabledFor(logging.INFO):
+        access_logger.info('%s', json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'bytes': response.content_length,
+            'ms': round(total * 1000, 1),
+            'styles': t.counts.get('styles', 0),
+            'pages': t.counts.get('pages', 0),
+            'phases': {name: round(sec * 1000, 1) for name, sec in t.seconds.items()},
+        }))
+    return response
+
+def prewarm():
+    """Slow one time setup, call before gunicorn forks workers.
+
+    e.g. in gunicorn.conf.py
+    def when_ready(server):
+        from draw import app
+        app.prewarm()
+    """
+    draw.prewarm()
+    # schema and migrations; don't hand open connections to forked workers
+    dbpool().close()
+
+class RevisionConflict(Exception):
+    "election changed since the revision a PATCH was based on"
+    def __init__(self, revision):
+        super().__init__('current revision is {}'.format(revision))
+        self.revision = revision
+
+# {itemid: (revision, election), ...} least to most recently used
+_parsed = collections.OrderedDict()
+_parsed_lock = threading.Lock()
+
+def _remember(itemid, revision, er):
+    with _parsed_lock:
+        _parsed[itemid] = (revision, er)
+        _parsed.move_to_end(itemid)
+        while len(_parsed) > PARSED_ELECTIONS:
+            _parsed.popitem(last=False)
+
+def _recall(itemid, revision):
+    with _parsed_lock:
+        rer = _parsed.get(itemid)
+        if rer and rer[0] == revision:
+            _parsed.move_to_end(itemid)
+            return rer[1]
+    return None
+
 def putelection(ob, itemid=None):
-    conn = db()
-    return _putelection(ob, itemid, conn)
+    "store whole election. returns (itemid, revision)"
+    return _sqlite('put', _putelection, ob, itemid, db())
 
 def _putelection(ob, itemid, conn):
+    data = json.dumps(ob)
     c = conn.cursor()
-    if itemid:
-        itemid = int(itemid)
-        # TODO: why isn't sqlite "ON CONFLICT ..." syntax working? sqlite3.sqlite_version === '3.22.0'
-        #c.execute("INSERT INTO elections (ROWID, data) VALUES (?, ?) ON CONFLICT (ROWID) DO UPDATE SET data = EXCLUDED.data", (itemid, json.dumps(ob)))
-        c.execute("INSERT OR REPLACE INTO elections (ROWID, data) VALUES (?, ?)", (itemid, json.dumps(ob)))
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        if itemid:
+            itemid = int(itemid)
+            c.execute(_election_update_sql, (data, itemid))
+            if c.rowcount == 0:
+                c.execute(_election_insert_id_sql, (itemid, data))
+            else:
+                c.execute(_patches_delete_sql, (itemid,))
+            c.execute(_election_revision_sql, (itemid,))
+            revision = c.fetchone()[0]
+        else:
+            c.execute(_election_insert_sql, (data,))
+            itemid = c.lastrowid
+            revision = 1
+            app.logger.info('new election %s', itemid)
         conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
         c.close()
-        return itemid
-    else:
-        c.execute("INSERT INTO elections (data) VALUES (?)", (json.dumps(ob),))
+    _remember(itemid, revision, ob)
+    return itemid, revision
+
+def patchelection(itemid, ops, revision):
+    """Apply RFC 6902 patch ops to election at revision.
+
+    Returns (election, new revision), (None, None) if there is no such election.
+    Raises RevisionConflict or patch.PatchError.
+    """
+    return _sqlite('patch', _patchelection, itemid, ops, revision, db())
+
+def _patchelection(itemid, ops, revision, conn):
+    itemid = int(itemid)
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute(_election_revision_sql, (itemid,))
+        row = c.fetchone()
+        if not row:
+            return None, None
+        if row[0] != revision:
+            raise RevisionConflict(row[0])
+        er = _loadelection(c, itemid, revision)
+        with instrument.phase('patch'):
+            er = patch.apply(er, ops)
+        revision += 1
+        c.execute(_patches_count_sql, (itemid,))
+        if c.fetchone()[0] + 1 >= PATCH_LOG_MAX:
+            c.execute(_election_compact_sql, (json.dumps(er), revision, itemid))
+            c.execute(_patches_delete_sql, (itemid,))
+        else:
+            # write only the edit
+            c.execute(_patches_insert_sql, (itemid, revision, json.dumps(ops)))
+            c.execute(_election_set_revision_sql, (revision, itemid))
         conn.commit()
-        itemid = c.lastrowid
-        app.logger.info('new election %s', itemid)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
         c.close()
-        return itemid
-
+    _remember(itemid, revision, er)
+    return er, revision
 
 def getelection(itemid):
-    conn = db()
-    return _getelection(itemid, conn)
+    er, revision = getelectionrev(itemid)
+    return er
 
-def _getelection(itemid, conn):
+def electionrevision(itemid):
+    "current revision without loading the election, None if there is no such election"
+    return _sqlite('revision', _electionrevision, itemid, db())
+
+def _electionrevision(itemid, conn):
     c = conn.cursor()
-    c.execute("SELECT data FROM elections WHERE ROWID = ?", (int(itemid),))
-    row = c.fetchone()
-    c.close()
-    if not row:
-        return None
-    return json.loads(row[0])
+    try:
+        c.execute(_election_revision_sql, (int(itemid),))
+        row = c.fetchone()
+    finally:
+        c.close()
+    return row and row[0]
 
+def getelectionrev(itemid):
+    "(election, revision) or (None, None)"
+    return _sqlite('get', _getelection, itemid, db())
 
-# pdf bytes in, png bytes out
-# bounces of two subprocess calls (all pipes, no disk) 'pdftoppm' and 'convert'
-def pdfToPng(pdfbytes):
-    result = subprocess.run(['pdftoppm'], input=pdfbytes, stdout=subprocess.PIPE)
-    result.check_returncode()
-    ppmbytes = result.stdout
-    result = subprocess.run(['convert', 'ppm:-', 'png:-'], input=ppmbytes, stdout=subprocess.PIPE)
-    result.check_returncode()
-    return result.stdout # png bytes
+def _getelection(itemid, conn):
+    itemid = int(itemid)
+    c = conn.cursor()
+    # one snapshot of the row and its patch log
+    c.execute("BEGIN")
+    try:
+        c.execute(_election_revision_sql, (itemid,))
+        row = c.fetchone()
+        if not row:
+            return None, None
+        revision = row[0]
+        return _loadelection(c, itemid, revision), revision
+    finally:
+        conn.rollback()
+        c.close()
+
+def _loadelection(c, itemid, revision):
+    # must be in a transaction
+    er = _recall(itemid, revision)
+    if er is not None:
+        return er
+    c.execute(_election_select_sql, (itemid,))
+    data = c.fetchone()[0]
+    with instrument.phase('parse'):
+        er = json.loads(data)
+    c.execute(_patches_select_sql, (itemid,))
+    rows = c.fetchall()
+    with instrument.phase('patch'):
+        for row in rows:
+            er = patch.apply(er, json.loads(row[0]))
+    _remember(itemid, revision, er)
+    return er
 
 
 @app.route('/')
 def home():
     return render_template('index.html', electionid="", urls=_election_urls(), prefix=request.environ.get('SCRIPT_NAME','').rstrip('/'))
 
+@app.route('/metrics')
+def metricsHandler():
+    return _metrics.text(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+@app.route('/debug/profile')
+def debugProfile():
+    """Sample stacks of this process's threads for ?seconds=N (default 10) at ?hz= (default 100).
+
+    Returns collapsed stacks for flamegraph.pl or speedscope. Only stacks
+    in our code unless ?all=1. Under gunicorn this is the one worker that
+    got the request, and it needs --threads > 1 to serve anything else
+    meanwhile.
+    """
+    if not DEBUG_TOKEN:
+        return 'not found', 404
+    auth = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth.encode(), ('Bearer ' + DEBUG_TOKEN).encode()):
+        return 'unauthorized', 401, {'WWW-Authenticate': 'Bearer'}
+    seconds = request.args.get('seconds', 10, type=float)
+    if not math.isfinite(seconds):
+        return 'bad seconds', 400
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    hz = min(max(request.args.get('hz', 100, type=int), 1), 1000)
+    if not _profile_lock.acquire(blocking=False):
+        return 'a profile is already running', 409
+    sampler = instrument.StackSampler(1.0 / hz, exclude=[threading.get_ident()], allThreads=bool(request.args.get('all')), paths=(draw.__file__, __file__))
+    try:
+        sampler.start()
+        time.sleep(seconds)
+    finally:
+        sampler.stop()
+        _profile_lock.release()
+    return sampler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8', 'X-Samples': str(sampler.samples)}
+
 @app.route('/demo.js')
 def demoraceget():
     return demorace.ElectionReport
@@ -183,31 +509,52 @@ def edit(electionid):
     }
     return render_template('index.html', **ctx)
 
+# /draw?both=1 and /item?both=1 alternative to json with base64 pdf
+# frames are an 8 byte big-endian length then that many bytes, like `pdftoppm -pngMultiBlock` output
+# first frame bubbles json, second frame pdf
+FRAMES_MIMETYPE = 'application/x-ballotstudio-frames'
+
+def _wants_frames():
+    if request.args.get('frames'):
+        return True
+    # not best_match(), */* shouldn't get frames
+    return any((mt == FRAMES_MIMETYPE) and q > 0 for mt, q in request.accept_mimetypes)
+
+def _frames_response(*blobs):
+    def gen():
+        for blob in blobs:
+            yield struct.pack('>Q', len(blob))
+            yield blob
+    size = sum(8 + len(blob) for blob in blobs)
+    return app.response_class(gen(), mimetype=FRAMES_MIMETYPE, headers={'Content-Length': str(size)})
+
+def _both_response(bothob):
+    if _wants_frames():
+        return _frames_response(json.dumps(bothob['bubbles']).encode(), bothob['pdf'])
+    with instrument.phase('base64'):
+        pdfb64 = base64.b64encode(bothob['pdf']).decode()
+    return {
+        'pdfb64': pdfb64,
+        'bubbles': bothob['bubbles'],
+    }, 200
+
 @app.route('/draw', methods=['POST'])
 def drawHandler():
     if request.content_type != 'application/json':
         return 'bad content-type', 400
-    er = request.get_json()
-    elections = er.get('Election', [])
-    el = elections[0]
-    ep = ElectionPrinter(er, el)
-    pdfbytes = io.BytesIO()
-    ep.drawToFile(outfile=pdfbytes)
-    pdfbytes = pdfbytes.getvalue()
+    er = _request_json()
+    bothob = _cached_bothob(er)
+    pdfbytes = bothob['pdf']
     if len(pdfbytes) == 0:
         app.logger.warning('zero byte pdf /draw')
-    bothob = {
-        'pdfb64': base64.b64encode(pdfbytes).decode(),
-        'bubbles': ep.getBubbles(),
-    }
     if request.args.get('both'):
-        return bothob, 200
+        return _both_response(bothob)
     if request.args.get('bubbles'):
         itemid = request.args.get('i')
         if not itemid:
             itemid = '{:08x}'.format(int(time.time()-1588036000))
-        mc().set(itemid, bothob, time=3600)
-        return {'bubbles':ep.getBubbles(),'item':itemid}, 200
+        cache_set(itemid, bothob, time=3600)
+        return {'bubbles':bothob['bubbles'],'item':itemid}, 200
     # otherwise just pdf
     return pdfbytes, 200, {"Content-Type":"application/pdf"}
 
@@ -216,16 +563,15 @@ def itemHandler():
     itemid = request.args.get('i')
     if not itemid:
         return '', 404
-    bothob = mc().get(itemid)
+    bothob = cache_get(itemid)
     if not bothob:
         return '', 404
     if request.args.get('both'):
-        return bothob, 200
+        return _both_response(bothob)
     if request.args.get('bubbles'):
         return {'bubbles':bothob['bubbles'],'item':itemid}, 200
     # otherwise just pdf
-    pdfbytes = base64.b64decode(bothob['pdfb64'])
-    return pdfbytes, 200, {"Content-Type":"application/pdf"}
+    return bothob['pdf'], 200, {"Content-Type":"application/pdf"}
 
 def _election_urls(itemid=None):
     if itemid is not None:
@@ -244,69 +590,298 @@ def _election_urls(itemid=None):
     out['staticroot'] = request.environ.get('SCRIPT_NAME','').rstrip('/') + '/static'
     return out
 
+def _saved_urls(itemid, er, revision):
+    "store first, render later. urls for the election and its render job"
+    out = _election_urls(itemid)
+    out['revision'] = revision
+    jobid = queue_render(er)
+    out['job'] = jobid
+    out['status'] = url_for('render_status_handler', jobid=jobid)
+    return out
+
 @app.route("/election", methods=['POST'])
 def putNewElection():
-    er = request.get_json()
-    bothob = _er_bothob(er)
-    itemid = putelection(er)
-    mc().set('e{}'.format(itemid), bothob, time=3600)
-    return _election_urls(itemid), 200
+    er = _request_json()
+    itemid, revision = putelection(er)
+    return _saved_urls(itemid, er, revision), 200
 
-@app.route("/election/<int:itemid>", methods=['GET', 'POST'])
+@app.route("/election/<int:itemid>", methods=['GET', 'POST', 'PATCH'])
 def elections(itemid):
     if request.method == 'POST':
-        er = request.get_json()
-        bothob = _er_bothob(er)
-        mc().set('e{}'.format(itemid), bothob, time=3600)
-        itemid = putelection(er, itemid)
-        return _election_urls(itemid), 200
+        er = _request_json()
+        itemid, revision = putelection(er, itemid)
+        return _saved_urls(itemid, er, revision), 200
+    elif request.method == 'PATCH':
+        # RFC 6902 JSON Patch against ?revision=N of the election
+        revision = request.args.get('revision', type=int)
+        if revision is None:
+            return {'error': 'PATCH needs ?revision= of the election it was made against'}, 428
+        try:
+            er, revision = patchelection(itemid, _request_json(), revision)
+        except RevisionConflict as e:
+            return {'error': str(e), 'revision': e.revision}, 409
+        except patch.TestFailed as e:
+            return {'error': str(e)}, 409
+        except patch.PatchError as e:
+            return {'error': str(e)}, 422
+        if er is None:
+            return {'error': 'no election {}'.format(itemid)}, 404
+        return _saved_urls(itemid, er, revision), 200
     elif request.method == 'GET':
-        er = getelection(itemid)
+        nm = _not_modified(itemid, 'json')
+        if nm:
+            return nm
+        er, revision = getelectionrev(itemid)
         if er is None:
             return {'error': 'no election {}'.format(itemid)}, 404
-        return er, 200
+        headers = _etag_header(itemid, revision, 'json')
+        headers['X-Revision'] = str(revision)
+        return er, 200, headers
     return 'nope', 400
 
 def _er_bothob(er):
     elections = er.get('Election', [])
     el = elections[0]
+    start = time.perf_counter()
     ep = ElectionPrinter(er, el)
     pdfbytes = io.BytesIO()
     ep.drawToFile(outfile=pdfbytes)
     pdfbytes = pdfbytes.getvalue()
+    render_seconds.observe(time.perf_counter() - start)
+    renders_total.inc()
+    styles_total.inc(n=len(ep.ballot_styles))
+    pages_total.inc(n=sum(bs.getLayout().numPages for bs in ep.ballot_styles))
     return {'pdf':pdfbytes, 'bubbles':ep.getBubbles()}
 
-def _bothob_core(itemid):
-    er = getelection(itemid)
-    if er is None:
-        return {'error': 'no election {}'.format(itemid)}, 404
+def render_key(er):
+    """Cache key for rendered artifacts of an ElectionReport.
+
+    Hash of canonical json of the report, draw Settings and renderer version.
+    Identical elections share a key no matter what id they are stored under.
+    """
+    with instrument.phase('key'):
+        h = hashlib.sha256()
+        h.update(json.dumps(er, sort_keys=True, separators=(',',':')).encode())
+        h.update(draw.gs.fingerprint().encode())
+        h.update(draw.rendererVersion().encode())
+        return 'r' + h.hexdigest()
+
+def _store_bothob(cachekey, bothob):
+    cache_set(cachekey, bothob, time=RENDER_CACHE_TTL + RENDER_CACHE_STALE)
+
+def _renewed(cachekey, bothob):
+    """bothob, stored again for another RENDER_CACHE_TTL if past fresh_until.
+
+    The key is a content hash, so rendering again would give the same bytes.
+    """
+    now = time.time()
+    if bothob.get('fresh_until', 0) > now:
+        return bothob
+    bothob = dict(bothob, fresh_until=now + RENDER_CACHE_TTL)
+    _store_bothob(cachekey, bothob)
+    return bothob
 
-    cachekey = 'e{}'.format(itemid)
-    bothob = mc().get(cachekey)
-    if not bothob:
-        bothob = _er_bothob(er)
-        mc().set(cachekey, bothob, time=3600)
+def _render_bothob(er, cachekey):
+    # a render for this key may have finished between our miss and getting the flight
+    bothob = cache_get(cachekey)
+    if bothob:
+        return _renewed(cachekey, bothob)
+    bothob = _er_bothob(er)
+    bothob['fresh_until'] = time.time() + RENDER_CACHE_TTL
+    _store_bothob(cachekey, bothob)
     return bothob
 
+def _cached_bothob(er, cachekey=None):
+    if cachekey is None:
+        cachekey = render_key(er)
+    bothob = cache_get(cachekey)
+    if bothob:
+        return _renewed(cachekey, bothob)
+    # includes waiting on another request's render of the same key
+    with instrument.phase('render'):
+        return _render_flights.do(cachekey, lambda: _render_bothob(er, cachekey))
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+# {render key: {'status': 'queued'|'running'}, ...}
+# finished jobs are dropped, their status comes from the cache
+_render_jobs = {}
+# failed jobs, oldest first. {render key: (expiry time, {'status': 'error', 'error': str}), ...}
+_render_errors = collections.OrderedDict()
+
+def renderpool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = concurrent.futures.ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='render')
+        return _render_pool
+
+def _set_job(jobid, status, **kwargs):
+    with _render_pool_lock:
+        kwargs['status'] = status
+        _render_jobs[jobid] = kwargs
+
+def _set_job_error(jobid, error):
+    now = time.time()
+    with _render_pool_lock:
+        _render_jobs.pop(jobid, None)
+        _render_errors.pop(jobid, None)
+        _render_errors[jobid] = (now + RENDER_ERROR_TTL, {'status':'error', 'error':error})
+        while _render_errors:
+            oldid, (expires, _) = next(iter(_render_errors.items()))
+            if (expires > now) and (len(_render_errors) <= RENDER_ERRORS_MAX):
+                break
+            del _render_errors[oldid]
+
+def queue_render(er):
+    """Render er in the background unless it is cached or already queued.
+
+    Returns job id, which is the render_key()
+    """
+    jobid = render_key(er)
+    bothob = cache_get(jobid)
+    if bothob:
+        _renewed(jobid, bothob)
+        return jobid
+    with _render_pool_lock:
+        job = _render_jobs.get(jobid)
+        if job:
+            return jobid
+        # try again after an earlier failure
+        _render_errors.pop(jobid, None)
+        _render_jobs[jobid] = {'status':'queued'}
+    renderpool().submit(_render_job, er, jobid)
+    return jobid
+
+def _render_job(er, jobid):
+    _set_job(jobid, 'running')
+    with app.app_context():
+        try:
+            _render_flights.do(jobid, lambda: _render_bothob(er, jobid))
+        except Exception as e:
+            app.logger.exception('render job %s failed', jobid)
+            _set_job_error(jobid, str(e))
+            return
+    with _render_pool_lock:
+        _render_jobs.pop(jobid, None)
+
+def render_status(jobid):
+    with _render_pool_lock:
+        job = _render_jobs.get(jobid)
+        if job is not None:
+            return dict(job)
+        failed = _render_errors.get(jobid)
+        if failed is not None:
+            expires, job = failed
+            if expires > time.time():
+                return dict(job)
+            del _render_errors[jobid]
+    if cache_get(jobid):
+        return {'status':'done'}
+    # expired or never queued
+    return {'status':'unknown'}
+
+@app.route("/render/<jobid>")
+def render_status_handler(jobid):
+    out = render_status(jobid)
+    out['job'] = jobid
+    if out['status'] == 'unknown':
+        return out, 404
+    return out, 200
+
+def election_etag(itemid, revision, *parts):
+    "strong ETag of an artifact of an election at revision, drawn with the current settings and renderer"
+    h = hashlib.sha256()
+    for x in (itemid, revision, draw.gs.fingerprint(), draw.rendererVersion()) + parts:
+        h.update(str(x).encode())
+        h.update(b'\0')
+    return '{}-{}-{}'.format(itemid, revision, h.hexdigest()[:24])
+
+def _etag_header(itemid, revision, kind, *parts):
+    etag = '"{}"'.format(election_etag(itemid, revision, kind, *parts))
+    if (kind in ('pdf', 'png')) and not draw.gs.deterministic:
+        # a redraw has the same content but not the same bytes
+        etag = 'W/' + etag
+    return {'ETag': etag}
+
+def _not_modified(itemid, kind, *parts):
+    """304 response if the client's If-None-Match has the current ETag, else None.
+
+    Only looks up the election's revision: nothing is loaded, parsed or drawn.
+    """
+    if not request.if_none_match:
+        return None
+    revision = electionrevision(itemid)
+    if revision is None:
+        return None
+    if request.if_none_match.contains_weak(election_etag(itemid, revision, kind, *parts)):
+        return '', 304, _etag_header(itemid, revision, kind, *parts)
+    return None
+
+def _bothob_core(itemid):
+    "(bothob, revision) or (None, None)"
+    er, revision = getelectionrev(itemid)
+    if er is None:
+        return None, None
+    return _cached_bothob(er), revision
+
 @app.route("/election/<int:itemid>.pdf")
 def election_pdf(itemid):
-    bothob = _bothob_core(itemid)
+    nm = _not_modified(itemid, 'pdf')
+    if nm:
+        return nm
+    bothob, revision = _bothob_core(itemid)
+    if bothob is None:
+        return {'error': 'no election {}'.format(itemid)}, 404
     pdfbytes = bothob['pdf']
-    return pdfbytes, 200, {"Content-Type":"application/pdf"}
+    headers = _etag_header(itemid, revision, 'pdf')
+    headers["Content-Type"] = "application/pdf"
+    return pdfbytes, 200, headers
+
+def _page_png(itemid, page, dpi):
+    dpi = raster.clampDpi(dpi)
+    nm = _not_modified(itemid, 'png', page, dpi)
+    if nm:
+        return nm
+    er, revision = getelectionrev(itemid)
+    if er is None:
+        return {'error': 'no election {}'.format(itemid)}, 404
+    cachekey = render_key(er)
+    # each (page, dpi) is cached on its own
+    pngkey = '{}:p{}:d{}'.format(cachekey, page, dpi)
+    pngbytes = cache_get(pngkey)
+    if pngbytes is None:
+        bothob = _cached_bothob(er, cachekey)
+        try:
+            start = time.perf_counter()
+            with instrument.phase('raster'):
+                pngbytes = raster.pageToPng(bothob['pdf'], page, dpi)
+            raster_seconds.observe(time.perf_counter() - start, raster.METHOD)
+        except raster.PageOutOfRange:
+            return {'error': 'no page {} in election {}'.format(page, itemid)}, 404
+        cache_set(pngkey, pngbytes, time=RENDER_CACHE_TTL + RENDER_CACHE_STALE)
+    headers = _etag_header(itemid, revision, 'png', page, dpi)
+    headers["Content-Type"] = "image/png"
+    return pngbytes, 200, headers
 
 @app.route("/election/<int:itemid>.png")
 def election_png(itemid):
-    bothob = _bothob_core(itemid)
-    pngbytes = bothob.get('png')
-    if pngbytes is None:
-        pngbytes = pdfToPng(bothob['pdf'])
-        bothob['png'] = pngbytes
-    return pngbytes, 200, {"Content-Type":"image/png"}
+    # first page
+    return _page_png(itemid, 1, request.args.get('dpi', raster.DEFAULT_DPI, type=int))
+
+@app.route("/election/<int:itemid>/page/<int:page>.png")
+def election_page_png(itemid, page):
+    return _page_png(itemid, page, request.args.get('dpi', raster.DEFAULT_DPI, type=int))
 
 @app.route("/election/<int:itemid>_bubbles.json")
 def election_bubblejson(itemid):
-    bothob = _bothob_core(itemid)
-    return bothob['bubbles'], 200 # implicit dict-to-json return
+    nm = _not_modified(itemid, 'bubbles')
+    if nm:
+        return nm
+    bothob, revision = _bothob_core(itemid)
+    if bothob is None:
+        return {'error': 'no election {}'.format(itemid)}, 404
+    return bothob['bubbles'], 200, _etag_header(itemid, revision, 'bubbles') # implicit dict-to-json return
 
 @app.route("/election/<int:electionid>/scan")
 def scanform(electionid):
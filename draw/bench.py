@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#
+# Benchmarks for the ballot renderer.
+#
+# python3 -m draw.bench memory --styles 2000 --contests 60
+# python3 -m draw.bench suite --save bench.json
+# python3 -m draw.bench suite --baseline bench.json --threshold 0.25
+#
+# Run from a directory with resources/ in it, as for draw.py.
+
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import draw
+from . import synth
+
+logger = logging.getLogger(__name__)
+
+def memory(er):
+    """Bytes allocated building draw objects and laying out every style.
+
+    Returns {'retained': bytes still held after layout, 'peak': bytes}
+    """
+    draw._ensure_fonts()
+    el = er['Election'][0]
+    tracemalloc.start()
+    try:
+        start = time.monotonic()
+        ep = draw.ElectionPrinter(er, el)
+        for bs in ep.ballot_styles:
+            bs.layout(draw.gs.pagesize)
+        elapsed = time.monotonic() - start
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'styles': len(ep.ballot_styles),
+        'retained': retained,
+        'peak': peak,
+        'seconds': elapsed,
+    }
+
+# synth.generate() arguments for each suite size
+SIZES = {
+    'small': dict(parties=3, contests=8, candidates=3, styles=3),
+    'county': dict(parties=6, contests=40, candidates=4, styles=200),
+    'statewide': dict(parties=8, contests=60, candidates=5, styles=2000),
+}
+
+# metrics where bigger is worse; everything in 'ms' is too
+_worseIfHigher = ('ms_per_style', 'bytes_per_page', 'peak')
+_worseIfLower = ('pages_per_sec',)
+# phases faster than this are too noisy to call a regression on
+_minPhaseMs = 5.0
+# Separate processes running the same code differ by up to ~20ms on a
+# 60ms phase, so a phase must also be slower by this much to count.
+_minSlowdownMs = 30.0
+# derived metric: phase it is computed from, for the same guards
+_derivedFrom = {
+    'ms_per_style': 'drawToFile',
+    'pages_per_sec': 'drawToFile',
+}
+# median of this many runs of each phase. single runs vary by more than
+# any sensible threshold, and so does the fastest of a few.
+DEFAULT_REPEAT = 5
+
+class _Timer:
+    def __init__(self):
+        self.ms = {}
+        # {name: (slowest - fastest) / median}
+        self.spread = {}
+        # {name: [ms of each run]}
+        self.runs = {}
+    def __call__(self, name, fn, repeat=1, before=None):
+        """median of repeat runs of fn(), in ms, pooled with earlier calls with the same name.
+        before() is run untimed ahead of each run. Garbage collection is off
+        while fn() runs, as in timeit. returns the last result.
+        """
+        runs = self.runs.setdefault(name, [])
+        for _ in range(repeat):
+            if before is not None:
+                before()
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                out = fn()
+                runs.append((time.perf_counter() - start) * 1000)
+            finally:
+                gc.enable()
+        median = statistics.median(runs)
+        self.ms[name] = round(median, 3)
+        self.spread[name] = round((max(runs) - min(runs)) / median, 3) if median else 0
+        return out
+
+def _drawPhases(er, timer, repeat):
+    "context, layout, BallotStyle.draw, save and getBubbles one at a time"
+    el = er['Election'][0]
+    ep = timer('context', lambda: draw.ElectionPrinter(er, el), repeat)
+    def layout():
+        for bs in ep.ballot_styles:
+            bs.layout(draw.gs.pagesize)
+    timer('layout', layout, repeat)
+    for _ in range(repeat):
+        # a canvas is only saved once, each run gets a new one
+        c = draw._newCanvas(io.BytesIO(), ep.drawTime())
+        def drawStyles():
+            for bs in ep.ballot_styles:
+                bs.draw(c, draw.gs.pagesize, bs.getLayout())
+        timer('draw', drawStyles)
+        timer('save', c.save)
+    timer('bubbles', ep.getBubbles, repeat)
+    return ep
+
+def _appPhases(er, timer, repeat):
+    "Flask endpoints through the test client, cold and cached"
+    if not os.getenv('BALLOTSTUDIO_SQLITE'):
+        os.environ['BALLOTSTUDIO_SQLITE'] = os.path.join(tempfile.mkdtemp(prefix='bsbench'), 'bench.sqlite')
+    from . import app as A
+    client = A.app.test_client()
+    def cold():
+        if A._cache is not None:
+            A._cache.close()
+            A._cache = None
+        with A._parsed_lock:
+            A._parsed.clear()
+    def check(r):
+        if r.status_code != 200:
+            raise Exception('{} {}'.format(r.status_code, r.get_data()[:200]))
+        return r
+    timer('app_draw', lambda: check(client.post('/draw', json=er)), repeat, before=cold)
+    # POST /election would also queue a background render, store directly
+    with A.app.app_context():
+        itemid, _ = timer('app_put', lambda: A.putelection(er), repeat)
+    timer('app_pdf', lambda: check(client.get('/election/{}.pdf'.format(itemid))), repeat, before=cold)
+    timer('app_pdf_cached', lambda: check(client.get('/election/{}.pdf'.format(itemid))), repeat)
+    timer('app_bubbles_cached', lambda: check(client.get('/election/{}_bubbles.json'.format(itemid))), repeat)
+    cold()
+
+def runSize(params, repeat=DEFAULT_REPEAT, app=True, mem=True):
+    "time every phase on one synthetic election"
+    timer = _Timer()
+    er = synth.generate(**params)
+    erjson = json.dumps(er)
+    er = timer('parse', lambda: json.loads(erjson), repeat)
+    _drawPhases(er, timer, repeat)
+    # end to end, on a fresh printer
+    out = io.BytesIO()
+    def drawToFile():
+        out.seek(0)
+        out.truncate()
+        ep = draw.ElectionPrinter(er, er['Election'][0])
+        ep.drawToFile(out)
+        return ep
+    ep = timer('drawToFile', drawToFile, repeat)
+    styles = len(ep.ballot_styles)
+    pages = sum(len(bs.getLayout().pages) for bs in ep.ballot_styles)
+    pdfbytes = len(out.getvalue())
+    if app:
+        _appPhases(er, timer, repeat)
+    seconds = timer.ms['drawToFile'] / 1000
+    result = {
+        'params': params,
+        'styles': styles,
+        'pages': pages,
+        'pdf_bytes': pdfbytes,
+        'ms': timer.ms,
+        'spread': timer.spread,
+        'ms_per_style': round(timer.ms['drawToFile'] / max(1, styles), 3),
+        'pages_per_sec': round(pages / seconds, 2) if seconds else None,
+        'bytes_per_page': pdfbytes // max(1, pages),
+    }
+    if mem:
+        tracemalloc.start()
+        try:
+            drawToFile()
+            result['peak'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+def suite(sizes=None, repeat=DEFAULT_REPEAT, app=True, mem=True):
+    draw._ensure_fonts()
+    # first draw in a process loads images and fills text caches, keep it out of the numbers
+    warm = synth.generate(**SIZES['small'])
+    draw.ElectionPrinter(warm, warm['Election'][0]).drawToFile(io.BytesIO())
+    results = {}
+    for name in (sizes or SIZES.keys()):
+        start = time.monotonic()
+        results[name] = runSize(SIZES[name], repeat, app, mem)
+        logger.info('%s: %.1fs', name, time.monotonic() - start)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'renderer': draw.rendererVersion(),
+        'sizes': results,
+    }
+
+def compare(baseline, current, threshold):
+    """Regressions of current against baseline beyond threshold (0.25 = 25%).
+
+    A timed phase is also allowed the larger spread of its runs in either
+    result, since that much changes with nothing changed.
+    Returns a list of messages, empty if nothing got worse.
+    """
+    out = []
+    def worse(name, metric, old, new, higher, limit):
+        if not old or new is None:
+            return
+        change = (new - old) / old
+        if (change > limit) if higher else (-change > limit):
+            out.append('{} {}: {} -> {} ({:+.0%}, allowed {:.0%})'.format(name, metric, old, new, change, limit))
+    for name, cur in current['sizes'].items():
+        old = baseline.get('sizes', {}).get(name)
+        if old is None:
+            continue
+        def noise(phase):
+            "True if the change in phase is too small to tell from run to run noise"
+            oldms = old['ms'].get(phase)
+            ms = cur['ms'].get(phase)
+            if (oldms is None) or (ms is None):
+                return True
+            return (max(oldms, ms) < _minPhaseMs) or (abs(ms - oldms) < _minSlowdownMs)
+        def limit(phase):
+            return threshold + max(old.get('spread', {}).get(phase, 0), cur.get('spread', {}).get(phase, 0))
+        for phase, ms in cur['ms'].items():
+            if noise(phase):
+                continue
+            worse(name, phase + '_ms', old['ms'][phase], ms, True, limit(phase))
+        for metrics, higher in ((_worseIfHigher, True), (_worseIfLower, False)):
+            for metric in metrics:
+                phase = _derivedFrom.get(metric)
+                if phase is None:
+                    worse(name, metric, old.get(metric), cur.get(metric), higher, threshold)
+                elif not noise(phase):
+                    worse(name, metric, old.get(metric), cur.get(metric), higher, limit(phase))
+    return out
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument('bench', choices=('memory', 'suite'))
+    ap.add_argument('--styles', type=int, default=2000)
+    ap.add_argument('--contests', type=int, default=60)
+    ap.add_argument('--candidates', type=int, default=5)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--sizes', default=','.join(SIZES.keys()), help='suite: comma separated from ' + ','.join(SIZES.keys()))
+    ap.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='suite: median of N runs of each phase')
+    ap.add_argument('--no-app', dest='app', default=True, action='store_false', help='suite: skip Flask endpoints')
+    ap.add_argument('--no-memory', dest='mem', default=True, action='store_false', help='suite: skip the traced run for peak memory')
+    ap.add_argument('--save', help='suite: write results json here')
+    ap.add_argument('--baseline', help='suite: results json to compare against, exit 1 on regressions')
+    ap.add_argument('--threshold', type=float, default=0.25, help='suite: allowed slowdown, 0.25 = 25%%')
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.bench == 'suite':
+        result = suite(args.sizes.split(','), args.repeat, args.app, args.mem)
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        if args.save:
+            with open(args.save, 'w') as fout:
+                json.dump(result, fout, indent=2)
+                fout.write('\n')
+        if args.baseline:
+            with open(args.baseline) as fin:
+                baseline = json.load(fin)
+            regressions = compare(baseline, result, args.threshold)
+            for msg in regressions:
+                sys.stderr.write('REGRESSION ' + msg + '\n')
+            if regressions:
+                sys.exit(1)
+        return
+    er = synth.generate(contests=args.contests, candidates=args.candidates, styles=args.styles, seed=args.seed)
+    result = memory(er)
+    result['bytes_per_style'] = result['retained'] // max(1, result['styles'])
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,45 @@
 #!/usr/bin/env python3
 
+import collections
+import heapq
+import sys
 import threading
 import time
 
 now = time.time
 
+def sizeof(value):
+    "approximate bytes held by a cached value"
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(sizeof(k) + sizeof(v) for k,v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(x) for x in value)
+    return sys.getsizeof(value)
+
 class meta:
-    def __init__(self, ttl=None):
+    def __init__(self, ttl=None, size=0):
         self.ttl = ttl
+        self.size = size
 
 class Cache:
-    def __init__(self):
-        self.items = {}
+    """Thread safe in-process cache.
+
+    Least recently used items are evicted to stay under maxbytes (if set).
+    Expired items are found by a heap of expiry times instead of scanning every key.
+    """
+    def __init__(self, maxbytes=None):
+        self.maxbytes = maxbytes
+        # {key: (meta, value), ...} in least to most recently used order
+        self.items = collections.OrderedDict()
+        # [(ttl, key), ...] may hold stale entries for keys since re-set or removed
+        self.expiry = []
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
         self.lock = threading.Lock()
         self.closer = threading.Condition(self.lock)
         self.t = threading.Thread(target=self.gcThread)
@@ -24,8 +52,24 @@ class Cache:
         self.t.join(1)
 
     def set(self, key, value, time=None):
+        ttl = None
+        if time is not None:
+            ttl = now() + time
+        m = meta(ttl, sizeof(value))
         with self.lock:
-            self.items[key] = (meta(now() + time), value)
+            self._remove(key)
+            if (self.maxbytes is not None) and (m.size > self.maxbytes):
+                # would evict everything and still not fit
+                return
+            self.items[key] = (m, value)
+            self.bytes += m.size
+            if ttl is not None:
+                heapq.heappush(self.expiry, (ttl, key))
+            if self.maxbytes is not None:
+                while self.bytes > self.maxbytes:
+                    oldkey = next(iter(self.items))
+                    self._remove(oldkey)
+                    self.evictions += 1
 
     def get(self, key):
         with self.lock:
@@ -33,9 +77,50 @@ class Cache:
             if mv:
                 m, v = mv
                 if (m.ttl is None) or (m.ttl > now()):
+                    self.items.move_to_end(key)
+                    self.hits += 1
                     return v
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
             return None
 
+    def delete(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'items': len(self.items),
+                'bytes': self.bytes,
+                'maxbytes': self.maxbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _remove(self, key):
+        # must hold self.lock
+        mv = self.items.pop(key, None)
+        if mv:
+            self.bytes -= mv[0].size
+
+    def _expire(self):
+        # must hold self.lock
+        t = now()
+        while self.expiry and (self.expiry[0][0] < t):
+            ttl, k = heapq.heappop(self.expiry)
+            mv = self.items.get(k)
+            if mv and (mv[0].ttl == ttl):
+                self._remove(k)
+                self.expirations += 1
+        if len(self.expiry) > 2 * len(self.items) + 64:
+            # drop stale heap entries for keys that were re-set or removed
+            self.expiry = [(m.ttl, k) for k,(m,v) in self.items.items() if m.ttl is not None]
+            heapq.heapify(self.expiry)
+
     def gcThread(self):
         self.closer.acquire()
         while True:
@@ -45,11 +130,49 @@ class Cache:
                 return
 
             # do garbage collection
-            t = now()
-            todel = []
-            for k,mv in self.items.items():
-                m,v = mv
-                if m.ttl and (m.ttl < t):
-                    todel.append(k)
-            for k in todel:
-                self.items.pop(k)
+            self._expire()
+
+
+class _call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.err = None
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one call.
+
+    Callers that arrive while a call for their key is running wait for it and get its result.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _call()
+                self.calls[key] = call
+        if leader:
+            self._run(key, call, fn)
+        else:
+            call.done.wait()
+        if call.err is not None:
+            raise call.err
+        return call.value
+
+    def inflight(self, key):
+        with self.lock:
+            return key in self.calls
+
+    def _run(self, key, call, fn):
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.err = e
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
@@ -2,20 +2,26 @@
 # -*- mode: Python; coding: utf-8 -*-
 #
 
+import datetime
+import functools
 import glob
-import io
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
 import time
 import statistics
 import sys
+import threading
+import weakref
 
 from PIL import Image
 import fontTools.ttLib
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.units import inch, mm, cm
+from reportlab.pdfbase import pdfdoc
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.platypus import Paragraph
@@ -23,6 +29,14 @@ from reportlab.platypus import Paragraph
 from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.utils import ImageReader
 
+# timing and profiling live in their own module so that editing them
+# doesn't change rendererVersion() and invalidate every cached render
+try:
+    from .instrument import phase, timings, timingsStart, timingsStop, StackSampler
+except ImportError:
+    # python3 draw/draw.py
+    from instrument import phase, timings, timingsStart, timingsStop, StackSampler
+
 logger = logging.getLogger(__name__)
 
 class TodoException(Exception):
@@ -30,13 +44,20 @@ class TodoException(Exception):
 
 
 class Bfont:
-    def __init__(self, path, name=None):
+    def __init__(self, path, name=None, capHeightPerPt=None):
         self.name = name
         self.path = path
-        self.capHeightPerPt = None
-        self._measureCapheight()
-        lfont = TTFont(self.name, self.path)
-        pdfmetrics.registerFont(lfont)
+        self.capHeightPerPt = capHeightPerPt
+        if (self.capHeightPerPt is None) or (self.name is None):
+            self._measureCapheight()
+        self.registered = False
+
+    def register(self):
+        "register with reportlab, parses the whole font file"
+        if not self.registered:
+            lfont = TTFont(self.name, self.path)
+            pdfmetrics.registerFont(lfont)
+            self.registered = True
 
     def _measureCapheight(self):
         ftt = fontTools.ttLib.TTFont(self.path)
@@ -61,14 +82,80 @@ for mayber in (os.path.join(os.getcwd(), 'resources'), os.path.join(os.path.dirn
         resources = mayber
         break
 fonts = {}
+_fonts_lock = threading.RLock()
+# reportlab subsets TrueType fonts in canvas.save() by seeking around one
+# shared font file reader per font, so two saves at once can read each
+# other's tables (KeyError in makeSubset). Drawing before that is fine.
+_save_lock = threading.Lock()
+
+# {path: {name, capHeightPerPt, mtime, size}, ...} saved between runs so font files aren't parsed on every start
+fontMetricsCachePath = os.getenv('BALLOTSTUDIO_FONT_CACHE') or os.path.join(
+    os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'ballotstudio', 'fontmetrics.json')
+
+def _fontPaths():
+    out = glob.glob('/usr/share/fonts/truetype/liberation/*.ttf')
+    if resources:
+        out += glob.glob(os.path.join(resources,'*.ttf'))
+    return out
 
-def _ensure_fonts():
-    if not fonts:
-        for fpath in glob.glob('/usr/share/fonts/truetype/liberation/*.ttf') + glob.glob(os.path.join(resources,'*.ttf')):
+def _loadFontMetrics():
+    try:
+        with open(fontMetricsCachePath) as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return {}
+
+def _saveFontMetrics(metrics):
+    try:
+        os.makedirs(os.path.dirname(fontMetricsCachePath), exist_ok=True)
+        tpath = fontMetricsCachePath + '.{}.tmp'.format(os.getpid())
+        with open(tpath, 'w') as fout:
+            json.dump(metrics, fout)
+        os.replace(tpath, fontMetricsCachePath)
+    except OSError as e:
+        logger.warning('could not save font metrics to %s: %s', fontMetricsCachePath, e)
+
+def _loadFonts():
+    "fill fonts{} with metrics, from cache where font file is unchanged"
+    cached = _loadFontMetrics()
+    metrics = {}
+    for fpath in _fontPaths():
+        st = os.stat(fpath)
+        fm = cached.get(fpath)
+        if fm and (fm.get('mtime') == st.st_mtime) and (fm.get('size') == st.st_size):
+            xf = Bfont(fpath, fm['name'], fm['capHeightPerPt'])
+        else:
             xf = Bfont(fpath)
-            fonts[xf.name] = xf
+        metrics[fpath] = {'name':xf.name, 'capHeightPerPt':xf.capHeightPerPt, 'mtime':st.st_mtime, 'size':st.st_size}
+        fonts[xf.name] = xf
+    if metrics != cached:
+        _saveFontMetrics(metrics)
+    logger.info('fonts: ' + ', '.join([repr(n) for n in fonts.keys()]))
+
+def _settingsFontNames(settings):
+    return set([v for k,v in settings.__dict__.items() if k.endswith('FontName')])
+
+def _ensure_fonts(settings=None):
+    "load font metrics, register with reportlab only the fonts settings uses"
+    if settings is None:
+        settings = gs
+    with _fonts_lock:
+        if not fonts:
+            _loadFonts()
+        for name in _settingsFontNames(settings):
+            xf = fonts.get(name)
+            if xf is None:
+                logger.warning('font %r in settings not found', name)
+                continue
+            xf.register()
+
+def prewarm():
+    """Do slow one time setup now instead of on first draw.
 
-        logger.info('fonts: ' + ', '.join([repr(n) for n in fonts.keys()]))
+    e.g. from gunicorn's when_ready hook, before forking workers.
+    """
+    _ensure_fonts()
 
 fontsans = 'Liberation Sans'
 fontsansbold = 'Liberation Sans Bold'
@@ -76,6 +163,9 @@ fontsansbold = 'Liberation Sans Bold'
 #fontsansbold = 'Noto Sans Bold'
 # TODO: figure out how to use 亀 etc that aren't in the core font file
 
+# {Settings: (settings values, fingerprint)} so unchanged settings aren't hashed again
+_fingerprints = weakref.WeakKeyDictionary()
+
 class Settings:
     def __init__(self):
         self.headerFontName = fontsansbold
@@ -107,13 +197,116 @@ class Settings:
         self.nowstrFontName = fontsans
         self.pageMargin = 0.5 * inch # inset from paper edge
         self.pagesize = letter
+        # draw each distinct contest, and the instructions, once per PDF as a form XObject and place it with doForm
+        self.contestForms = True
+        # same input, same PDF bytes: 'generated' time is the report's GeneratedDate, fixed PDF dates and id
+        self.deterministic = False
+    def fingerprint(self):
+        "stable hash of all settings values"
+        state = tuple(self.__dict__.items())
+        last = _fingerprints.get(self)
+        if (last is not None) and (last[0] == state):
+            return last[1]
+        fp = hashlib.sha1(json.dumps(self.__dict__, sort_keys=True).encode()).hexdigest()
+        _fingerprints[self] = (state, fp)
+        return fp
 
 
 gs = Settings()
 
+_renderer_version = None
+
+def rendererVersion():
+    "hash of this module's source; changes whenever drawing code changes"
+    global _renderer_version
+    if _renderer_version is None:
+        with open(os.path.abspath(__file__), 'rb') as fin:
+            _renderer_version = hashlib.sha1(fin.read()).hexdigest()
+    return _renderer_version
+
+# Text measurement and wrapping, memoized.
+# The same candidate, party and contest names repeat across many ballot styles.
+
+@functools.lru_cache(maxsize=65536)
+def stringWidth(text, fontName, fontSize):
+    return pdfmetrics.stringWidth(text, fontName, fontSize)
+
+def _breakWord(word, fontName, fontSize, width):
+    "split a word too long for width into pieces that fit"
+    out = []
+    cur = ''
+    for ch in word:
+        if cur and (stringWidth(cur + ch, fontName, fontSize) > width):
+            out.append(cur)
+            cur = ch
+        else:
+            cur += ch
+    out.append(cur)
+    return out
+
+@functools.lru_cache(maxsize=65536)
+def wrapText(text, fontName, fontSize, width):
+    """Wrap text to lines no wider than width.
+
+    Keeps existing newlines. Returns tuple of lines, at least one.
+    """
+    lines = []
+    spaceWidth = stringWidth(' ', fontName, fontSize)
+    for para in text.split('\n'):
+        line = []
+        linew = 0
+        for word in para.split(' '):
+            ww = stringWidth(word, fontName, fontSize)
+            if line and (linew + spaceWidth + ww <= width):
+                line.append(word)
+                linew += spaceWidth + ww
+                continue
+            if line:
+                lines.append(' '.join(line))
+            if ww > width:
+                pieces = _breakWord(word, fontName, fontSize, width)
+                lines.extend(pieces[:-1])
+                word = pieces[-1]
+                ww = stringWidth(word, fontName, fontSize)
+            line = [word]
+            linew = ww
+        lines.append(' '.join(line))
+    return tuple(lines)
+
+def textHeight(text, fontName, fontSize, leading, width):
+    return leading * len(wrapText(text, fontName, fontSize, width))
+
+def _selectionTextWidth(width):
+    "room for text right of a bubble"
+    return width - (gs.bubbleLeftPad + gs.bubbleWidth + gs.bubbleRightPad)
+
+def _titleTextWidth(width):
+    "room for contest title and subtitle text, inset 0.1 inch on both sides"
+    return width - (1 + (0.2 * inch))
+
+def _memoHeight(ob, key, compute):
+    """compute() once per draw object, key and settings.
+
+    Draw objects are built from one parse of the election json,
+    new json gets new draw objects and empty memos.
+    """
+    key = (key, gs.fingerprint())
+    heights = ob._heights
+    if heights is None:
+        heights = {}
+        ob._heights = heights
+    h = heights.get(key)
+    if h is None:
+        h = compute()
+        heights[key] = h
+    return h
+
 def setOptionalFields(self, ob):
+    "copy optional fields from json ob, only those in __slots__ for slotted classes"
+    slots = getattr(self, '__slots__', None)
     for field_name, default_value in self._optional_fields:
-        setattr(self, field_name, ob.get(field_name, default_value))
+        if (slots is None) or (field_name in slots):
+            setattr(self, field_name, ob.get(field_name, default_value))
 
 class Choice:
     def __init__(self, name, subtext=None):
@@ -123,13 +316,12 @@ class Choice:
         # TODO: wrap with optional max-5% squish instead of wrap
         # _bubbleCoords = (left, bottom, width, height)
         self._bubbleCoords = None
-    def height(self):
-        # TODO: multiline for name and subtext
-        y = 0
-        ypos = y - gs.candidateLeading
+    def height(self, width=(7.5/2)*inch - 1):
+        tw = _selectionTextWidth(width)
+        out = textHeight(self.name, gs.candidateFontName, gs.candidateFontSize, gs.candidateLeading, tw)
         if self.subtext:
-            ypos -= gs.candsubLeading
-        return -1*(ypos - (0.1 * inch))
+            out += textHeight(self.subtext, gs.candsubFontName, gs.candsubFontSize, gs.candsubLeading, tw)
+        return out + (0.1 * inch)
     def draw(self, c, x, y, width=(7.5/2)*inch - 1):
         # x,y is a top,left of a box to draw bubble and text into
         capHeight = fonts[gs.candidateFontName].capHeightPerPt * gs.candidateFontSize
@@ -142,19 +334,21 @@ class Choice:
         self._bubbleCoords = (x + gs.bubbleLeftPad, bubbleBottom, gs.bubbleWidth, bubbleHeight)
         c.roundRect(*self._bubbleCoords, radius=bubbleHeight/2)
         textx = x + gs.bubbleLeftPad + gs.bubbleWidth + gs.bubbleRightPad
-        # TODO: assumes one line
+        tw = _selectionTextWidth(width)
         c.setFillColorRGB(0,0,0)
+        lines = wrapText(self.name, gs.candidateFontName, gs.candidateFontSize, tw)
         txto = c.beginText(textx, y - gs.candidateFontSize)
         txto.setFont(gs.candidateFontName, gs.candidateFontSize, gs.candidateLeading)
-        txto.textLines(self.name)
+        txto.textLines(lines)
         c.drawText(txto)
-        ypos = y - gs.candidateLeading
+        ypos = y - (gs.candidateLeading * len(lines))
         if self.subtext:
+            lines = wrapText(self.subtext, gs.candsubFontName, gs.candsubFontSize, tw)
             txto = c.beginText(textx, ypos - gs.candsubFontSize)
             txto.setFont(gs.candsubFontName, gs.candsubFontSize, leading=gs.candsubLeading)
-            txto.textLines(self.subtext)
+            txto.textLines(lines)
             c.drawText(txto)
-            ypos -= gs.candsubLeading
+            ypos -= gs.candsubLeading * len(lines)
         # separator line
         c.setStrokeColorRGB(0,0,0)
         c.setLineWidth(0.25)
@@ -302,14 +496,19 @@ class BallotMeasureSelection:
         ('SequenceOrder', None), #int
         ('VoteCounts', []), #VoteCounts results objects
     )
+    # only what layout and drawing need, there may be very many of these
+    __slots__ = ('atid', 'selection', '_bubbleCoords', '_heights')
     def __init__(self, erctx, cs_json_object):
-        self.cs = cs_json_object
-        self.atid = self.cs['@id']
-        self.selection = self.cs['Selection']
-        setOptionalFields(self, self.cs)
+        cs = cs_json_object
+        self.atid = cs['@id']
+        self.selection = cs['Selection']
+        setOptionalFields(self, cs)
         self._bubbleCoords = None
+        self._heights = None
     def height(self, width):
-        out = gs.candidateLeading
+        return _memoHeight(self, width, lambda: self._height(width))
+    def _height(self, width):
+        out = textHeight(self.selection, gs.candidateFontName, gs.candidateFontSize, gs.candidateLeading, _selectionTextWidth(width))
         out += 0.1 * inch
         return out
     def draw(self, c, x, y, width):
@@ -323,13 +522,13 @@ class BallotMeasureSelection:
         self._bubbleCoords = (x + gs.bubbleLeftPad, bubbleBottom, gs.bubbleWidth, bubbleHeight)
         c.roundRect(*self._bubbleCoords, radius=bubbleHeight/2)
         textx = x + gs.bubbleLeftPad + gs.bubbleWidth + gs.bubbleRightPad
-        # TODO: assumes one line
         c.setFillColorRGB(0,0,0)
+        lines = wrapText(self.selection, gs.candidateFontName, gs.candidateFontSize, _selectionTextWidth(width))
         txto = c.beginText(textx, y - gs.candidateFontSize)
         txto.setFont(gs.candidateFontName, gs.candidateFontSize, gs.candidateLeading)
-        txto.textLines(self.selection)
+        txto.textLines(lines)
         c.drawText(txto)
-        ypos = y - gs.candidateLeading
+        ypos = y - (gs.candidateLeading * len(lines))
         # separator line
         c.setStrokeColorRGB(0,0,0)
         c.setLineWidth(0.25)
@@ -346,38 +545,55 @@ class CandidateSelection:
         ('SequenceOrder', None), #int
         ('VoteCounts', []), #VoteCounts results objects
     )
+    # only what layout and drawing need, there may be very many of these
+    __slots__ = ('atid', 'IsWriteIn', 'names', 'subtext', '_bubbleCoords', '_heights')
     def __init__(self, erctx, cs_json_object):
-        self.cs = cs_json_object
-        self.atid = self.cs['@id']
-        setOptionalFields(self, self.cs)
-        self.candidates = [erctx.getRawOb(cid) for cid in self.CandidateIds]
-        self.people = []
-        self.peopleparties = []
-        for c in self.candidates:
-            pid = c.get('PersonId')
-            if pid:
-                p = erctx.getRawOb(pid)
-                self.people.append(p)
-                pparty = p.get('PartyId')
-                party = pparty and erctx.getRawOb(pparty)
-                self.peopleparties.append(party)
+        cs = cs_json_object
+        self.atid = cs['@id']
+        setOptionalFields(self, cs)
+        candidateIds = cs.get('CandidateIds', [])
+        candidates = [erctx.getRawOb(cid) for cid in candidateIds]
+        # one name per candidate, e.g. a ticket. error text in place of missing names
+        if not candidates:
+            if not self.IsWriteIn:
+                self.names = ('error: no candidates in selection',)
             else:
-                self.people.append(None)
-                self.peopleparties.append(None)
-        self.parties = [erctx.getRawOb(x) for x in self.EndorsementPartyIds]
-        if self.parties:
-            self.subtext = ', '.join([p['Name'] for p in self.parties])
-        elif self.people:
-            peopleparties = [p['Name'] for p in filter(None, self.peopleparties)]
+                self.names = ()
+        else:
+            names = []
+            for cand in candidates:
+                ballotName = cand.get('BallotName')
+                if ballotName is None:
+                    ballotName = 'error: Ballot Name is required in csel for {}'.format(' '.join(candidateIds))
+                names.append(ballotName)
+            self.names = tuple(names)
+        parties = [erctx.getRawOb(x) for x in cs.get('EndorsementPartyIds', [])]
+        if parties:
+            self.subtext = ', '.join([p['Name'] for p in parties])
+        elif candidates:
+            peopleparties = []
+            for cand in candidates:
+                pid = cand.get('PersonId')
+                pparty = pid and erctx.getRawOb(pid).get('PartyId')
+                if pparty:
+                    peopleparties.append(erctx.getRawOb(pparty)['Name'])
             self.subtext = ', '.join(peopleparties)
         else:
             self.subtext = None
         self._bubbleCoords = None
+        self._heights = None
+    def ballotNames(self):
+        "one name per candidate, e.g. a ticket. error text in place of missing names"
+        return self.names
     def height(self, width):
-        # TODO: actually check render for width with party and subtitle and all that
-        out = gs.candidateLeading * len(self.candidates)
+        return _memoHeight(self, width, lambda: self._height(width))
+    def _height(self, width):
+        tw = _selectionTextWidth(width)
+        out = 0
+        for ballotName in self.ballotNames():
+            out += textHeight(ballotName, gs.candidateFontName, gs.candidateFontSize, gs.candidateLeading, tw)
         if self.subtext:
-            out += gs.candsubLeading
+            out += textHeight(self.subtext, gs.candsubFontName, gs.candsubFontSize, gs.candsubLeading, tw)
         if self.IsWriteIn:
             out += gs.candsubLeading
             out += gs.writeInHeight
@@ -394,29 +610,23 @@ class CandidateSelection:
         self._bubbleCoords = (x + gs.bubbleLeftPad, bubbleBottom, gs.bubbleWidth, bubbleHeight)
         c.roundRect(*self._bubbleCoords, radius=bubbleHeight/2)
         textx = x + gs.bubbleLeftPad + gs.bubbleWidth + gs.bubbleRightPad
-        # TODO: assumes one line
+        tw = _selectionTextWidth(width)
         c.setFillColorRGB(0,0,0)
-        ballotName = None
-        if not self.candidates:
-            if not self.IsWriteIn:
-                ballotName = 'error: no candidates in selection'
-        else:
-            ballotName = self.candidates[0].get('BallotName')
-            if ballotName is None:
-                ballotName = 'error: Ballot Name is required in csel for {}'.format(' '.join(self.CandidateIds))
         ypos = y
-        if ballotName:
-            txto = c.beginText(textx, y - gs.candidateFontSize)
+        for ballotName in self.ballotNames():
+            lines = wrapText(ballotName, gs.candidateFontName, gs.candidateFontSize, tw)
+            txto = c.beginText(textx, ypos - gs.candidateFontSize)
             txto.setFont(gs.candidateFontName, gs.candidateFontSize, gs.candidateLeading)
-            txto.textLines(ballotName) # TODO: fix for multiple candidate ticket
+            txto.textLines(lines)
             c.drawText(txto)
-            ypos -= gs.candidateLeading
+            ypos -= gs.candidateLeading * len(lines)
         if self.subtext:
+            lines = wrapText(self.subtext, gs.candsubFontName, gs.candsubFontSize, tw)
             txto = c.beginText(textx, ypos - gs.candsubFontSize)
             txto.setFont(gs.candsubFontName, gs.candsubFontSize, leading=gs.candsubLeading)
-            txto.textLines(self.subtext)
+            txto.textLines(lines)
             c.drawText(txto)
-            ypos -= gs.candsubLeading
+            ypos -= gs.candsubLeading * len(lines)
         if self.IsWriteIn:
             txto = c.beginText(textx, ypos - gs.candsubFontSize)
             txto.setFont(gs.candsubFontName, gs.candsubFontSize, leading=gs.candsubLeading)
@@ -436,6 +646,43 @@ class CandidateSelection:
         c.line(textx, sepy, x+width, sepy)
         return
 
+def _contestHeadHeight(width, title, subtitle):
+    tw = _titleTextWidth(width)
+    out = textHeight(title or '', gs.titleFontName, gs.titleFontSize, gs.titleLeading, tw)
+    out += textHeight(subtitle or '', gs.subtitleFontName, gs.subtitleFontSize, gs.subtitleLeading, tw)
+    return out
+
+def _drawContestHead(c, x, pos, width, title, subtitle):
+    "draw title and subtitle bands from pos down, return pos below them"
+    tw = _titleTextWidth(width)
+    # title
+    lines = wrapText(title or '', gs.titleFontName, gs.titleFontSize, tw)
+    bandHeight = gs.titleLeading * len(lines)
+    c.setStrokeColorRGB(*gs.titleBGColor)
+    c.setFillColorRGB(*gs.titleBGColor)
+    c.rect(x, pos - bandHeight, width, bandHeight, fill=1, stroke=0)
+    c.setFillColorRGB(0,0,0)
+    c.setStrokeColorRGB(0,0,0)
+    txto = c.beginText(x + 1 + (0.1 * inch), pos - gs.titleFontSize)
+    txto.setFont(gs.titleFontName, gs.titleFontSize, gs.titleLeading)
+    txto.textLines(lines)
+    c.drawText(txto)
+    pos -= bandHeight
+    # subtitle
+    lines = wrapText(subtitle or '', gs.subtitleFontName, gs.subtitleFontSize, tw)
+    bandHeight = gs.subtitleLeading * len(lines)
+    c.setStrokeColorCMYK(.1,0,0,0)
+    c.setFillColorCMYK(.1,0,0,0)
+    c.rect(x, pos - bandHeight, width, bandHeight, fill=1, stroke=0)
+    c.setFillColorRGB(0,0,0)
+    c.setStrokeColorRGB(0,0,0)
+    txto = c.beginText(x + 1 + (0.1 * inch), pos - gs.subtitleFontSize)
+    txto.setFont(gs.subtitleFontName, gs.subtitleFontSize, gs.subtitleLeading)
+    txto.textLines(lines)
+    c.drawText(txto)
+    pos -= bandHeight
+    return pos
+
 class BallotMeasureContest:
     "NIST 1500-100 v2 ElectionResults.BallotMeasureContest"
     _optional_fields = (
@@ -463,47 +710,26 @@ class BallotMeasureContest:
         ('VoteVariation', None), #ElectionResults.VoteVariation
         ('VotesAllowed', None), #int, probably 1
     )
+    # only what layout and drawing need
+    __slots__ = ('Name', 'ElectionDistrictId', 'BallotTitle', 'BallotSubTitle', 'draw_selections', '_heights')
     def __init__(self, erctx, contest_json_object):
         co = contest_json_object
-        self.co = co
         self.Name = co['Name']
         self.ElectionDistrictId = co['ElectionDistrictId'] # reference to a ReportingUnit gpunit
-        setOptionalFields(self, self.co)
-        self.draw_selections = [erctx.makeDrawOb(x) for x in self.ContestSelection]
+        setOptionalFields(self, co)
+        self.draw_selections = [erctx.makeDrawOb(x) for x in co.get('ContestSelection', [])]
+        self._heights = None
     def draw(self, c, x, y, width, draw_selections=None):
         if draw_selections is None:
             draw_selections = self.draw_selections
         pos = y - 3 # leave room for 3pt top border
-        # title
-        c.setStrokeColorRGB(*gs.titleBGColor)
-        c.setFillColorRGB(*gs.titleBGColor)
-        c.rect(x, pos - gs.titleLeading, width, gs.titleLeading, fill=1, stroke=0)
-        c.setFillColorRGB(0,0,0)
-        c.setStrokeColorRGB(0,0,0)
-        txto = c.beginText(x + 1 + (0.1 * inch), pos - gs.titleFontSize)
-        txto.setFont(gs.titleFontName, gs.titleFontSize)
-        txto.textLines(self.BallotTitle)
-        c.drawText(txto)
-        pos -= gs.titleLeading
-        # subtitle
-        c.setStrokeColorCMYK(.1,0,0,0)
-        c.setFillColorCMYK(.1,0,0,0)
-        c.rect(x, pos - gs.subtitleLeading, width, gs.subtitleLeading, fill=1, stroke=0)
-        c.setFillColorRGB(0,0,0)
-        c.setStrokeColorRGB(0,0,0)
-        # TODO: skip BallotSubTitle if null/empty
-        txto = c.beginText(x + 1 + (0.1 * inch), pos - gs.subtitleFontSize)
-        txto.setFont(gs.subtitleFontName, gs.subtitleFontSize)
-        txto.textLines(self.BallotSubTitle or '')
-        c.drawText(txto)
-        pos -= gs.subtitleLeading
+        pos = _drawContestHead(c, x, pos, width, self.BallotTitle, self.BallotSubTitle)
         c.setFillColorRGB(0,0,0)
         c.setStrokeColorRGB(0,0,0)
         # TODO SummaryText
         pos -= 0.1 * inch # header-choice gap
-        maxheight = self._maxheight(width-1)
+        maxheight = self._maxheight(width-1, draw_selections)
         for ds in draw_selections:
-            dy = ds.height(width)
             ds.draw(c, x+1, pos, width-1)
             pos -= maxheight
         pos -= 0.1 * inch # bottom padding
@@ -531,10 +757,13 @@ class BallotMeasureContest:
                 mh = h
         return mh
     def height(self, width, draw_selections=None):
-        draw_selections = draw_selections or self.draw_selections
-        out = self._maxheight(width-1) * len(draw_selections)
+        if draw_selections is None:
+            return _memoHeight(self, width, lambda: self._height(width, self.draw_selections))
+        return self._height(width, draw_selections)
+    def _height(self, width, draw_selections):
+        out = self._maxheight(width-1, draw_selections) * len(draw_selections)
         out += 4 # top and bottom border
-        out += gs.titleLeading + gs.subtitleLeading
+        out += _contestHeadHeight(width, self.BallotTitle, self.BallotSubTitle)
         out += 0.1 * inch # header-choice gap
         out += 0.1 * inch # bottom padding
         return out
@@ -561,50 +790,28 @@ class CandidateContest:
         ('VoteVariation', None), #ElectionResults.VoteVariation
         ('VotesAllowed', None), #int, probably 1
     )
+    # only what layout and drawing need
+    __slots__ = ('Name', 'ElectionDistrictId', 'VotesAllowed', 'BallotTitle', 'BallotSubTitle', 'offices', 'draw_selections', '_heights')
     def __init__(self, erctx, contest_json_object):
         co = contest_json_object
-        self.co = co
         self.Name = co['Name']
         self.ElectionDistrictId = co['ElectionDistrictId'] # reference to a ReportingUnit gpunit
         self.VotesAllowed = co['VotesAllowed']
-        setOptionalFields(self, self.co)
-        if self.OfficeIds:
-            self.offices = [erctx.getRawOb(x) for x in self.OfficeIds]
-        else:
-            self.offices = []
-        self.draw_selections = [erctx.makeDrawOb(x) for x in self.ContestSelection]
+        setOptionalFields(self, co)
+        self.offices = [erctx.getRawOb(x) for x in co.get('OfficeIds', [])]
+        self.draw_selections = [erctx.makeDrawOb(x) for x in co.get('ContestSelection', [])]
+        self._heights = None
     def draw(self, c, x, y, width, draw_selections=None):
         if draw_selections is None:
             draw_selections = self.draw_selections
         pos = y - 3 # leave room for 3pt top border
-        # title
-        c.setStrokeColorRGB(*gs.titleBGColor)
-        c.setFillColorRGB(*gs.titleBGColor)
-        c.rect(x, pos - gs.titleLeading, width, gs.titleLeading, fill=1, stroke=0)
-        c.setFillColorRGB(0,0,0)
-        c.setStrokeColorRGB(0,0,0)
-        txto = c.beginText(x + 1 + (0.1 * inch), pos - gs.titleFontSize)
-        txto.setFont(gs.titleFontName, gs.titleFontSize)
-        txto.textLines(self.BallotTitle)
-        c.drawText(txto)
-        pos -= gs.titleLeading
-        # subtitle
-        c.setStrokeColorCMYK(.1,0,0,0)
-        c.setFillColorCMYK(.1,0,0,0)
-        c.rect(x, pos - gs.subtitleLeading, width, gs.subtitleLeading, fill=1, stroke=0)
-        c.setFillColorRGB(0,0,0)
-        c.setStrokeColorRGB(0,0,0)
-        txto = c.beginText(x + 1 + (0.1 * inch), pos - gs.subtitleFontSize)
-        txto.setFont(gs.subtitleFontName, gs.subtitleFontSize)
-        txto.textLines(self.BallotSubTitle)
-        c.drawText(txto)
-        pos -= gs.subtitleLeading
+        pos = _drawContestHead(c, x, pos, width, self.BallotTitle, self.BallotSubTitle)
         pos -= 0.1 * inch # header-choice gap
         c.setFillColorRGB(0,0,0)
         c.setStrokeColorRGB(0,0,0)
         maxheight = self._maxheight(width-1, draw_selections)
         for ds in draw_selections:
-            dy = ds.height(width)
+            dy = ds.height(width-1)
             ds.draw(c, x+1, pos, width-1)
             pos -= max(maxheight,dy)
         pos -= 0.1 * inch # bottom padding
@@ -636,13 +843,15 @@ class CandidateContest:
         return mh
     def height(self, width, draw_selections=None):
         if draw_selections is None:
-            draw_selections = self.draw_selections
+            return _memoHeight(self, width, lambda: self._height(width, self.draw_selections))
+        return self._height(width, draw_selections)
+    def _height(self, width, draw_selections):
         mh = self._maxheight(width-1, draw_selections=draw_selections)
         out = 0
         for ds in draw_selections:
-            out += max(mh, ds.height(width))
+            out += max(mh, ds.height(width-1))
         out += 4 # top and bottom border
-        out += gs.titleLeading + gs.subtitleLeading
+        out += _contestHeadHeight(width, self.BallotTitle, self.BallotSubTitle)
         out += 0.1 * inch # header-choice gap
         out += 0.1 * inch # bottom padding
         return out
@@ -656,26 +865,93 @@ class InstructionsHeader:
     image2 = 'writein.png'
     instruction2 = 'To add a candidate, fill in the oval to the left of “or write-in” and print the name clearly on the dotted line.'
 
+    # {image file name: ImageReader}, decoded once per process
+    _images = {}
+    # {(width, settings fingerprint): part heights}, see _layout()
+    _layouts = {}
+    _lock = threading.Lock()
+    # Paragraph.drawOn() sets and deletes par.canv, so a Paragraph can only be
+    # drawn by one thread at a time. Each thread wraps its own.
+    _local = threading.local()
+
+    @classmethod
+    def _image(self, name):
+        im = self._images.get(name)
+        if im is None:
+            with self._lock:
+                im = self._images.get(name)
+                if im is None:
+                    im = ImageReader(os.path.join(resources, name))
+                    im.getRGBData() # decode now, not during some later draw
+                    self._images[name] = im
+        return im
+    @classmethod
+    def _availableWidth(self, width):
+        return width - (1 + (0.1 * inch))
+    @classmethod
+    def _paragraphs(self, width):
+        """This thread's wrapped instruction Paragraphs, [(par, height), ...]"""
+        cache = getattr(self._local, 'paragraphs', None)
+        if cache is None:
+            cache = {}
+            self._local.paragraphs = cache
+        key = (width, gs.fingerprint())
+        pars = cache.get(key)
+        if pars is None:
+            # TODO: configurable style instead of borrowing candsub style
+            availableWidth = self._availableWidth(width)
+            ips = ParagraphStyle('instructionParagraph')
+            pars = []
+            # TODO: warning style
+            for text in (self.instruction1, self.warning1, self.instruction2):
+                par = Paragraph(text, ips)
+                ww, wh = par.wrap(availableWidth, 100)
+                pars.append((par, wh))
+            cache[key] = pars
+        return pars
+    @classmethod
+    def _layout(self, width):
+        """Heights of the images and paragraphs, shared by all threads.
+
+        The same ImageReader goes to every drawImage() so reportlab embeds it
+        once per document as a shared image XObject.
+        """
+        key = (width, gs.fingerprint())
+        heights = self._layouts.get(key)
+        if heights is not None:
+            return heights
+        availableWidth = self._availableWidth(width)
+        def imageHeight(name):
+            imw, imh = self._image(name).getSize()
+            return imh * (availableWidth / imw)
+        (i1par, i1h), (w1par, w1h), (i2par, i2h) = self._paragraphs(width)
+        heights = (imageHeight(self.image1), i1h, w1h, imageHeight(self.image2), i2h)
+        with self._lock:
+            heights = self._layouts.setdefault(key, heights)
+        return heights
+
     @classmethod
     def height(self, width, draw_selections=None):
-        # y = 0
-        # x = 0
-        # pos = y - 3 # leave room for 3pt top border
-
-        # textx = x + 1 + (0.1 * inch)
-        # availableWidth = width - (1 + (0.1 * inch))
-        # bubbleImage = ImageReader(os.path.join(resources, self.image1))
-        # imw, imh = bubbleImage.getSize()
-        # imHeight = imh * (availableWidth / imw)
-        # pos -= imHeight
-
-        # return 3.0 * inch
         h = self._draw(None,0,0,width,draw_selections, enable=False)
         logger.debug("instructions height %r", h)
         return h
     @classmethod
     def draw(self, c, x, y, width, draw_selections=None):
-        self._draw(c,x,y,width,draw_selections, enable=True)
+        if not gs.contestForms:
+            self._draw(c,x,y,width,draw_selections, enable=True)
+            return
+        # the same on every ballot style: draw once per PDF as a form XObject,
+        # which also keeps reportlab from hashing the images on every drawImage()
+        name = 'instructions' + hashlib.sha1(json.dumps([width, gs.fingerprint()]).encode()).hexdigest()[:20]
+        if not c.hasForm(name):
+            height = self.height(width)
+            c.beginForm(name, lowerx=-2, lowery=-(height+2), upperx=gs.pagesize[0], uppery=2)
+            self._draw(c, 0, 0, width, draw_selections, enable=True)
+            c.endForm()
+        c.saveState()
+        c.translate(x, y)
+        c.doForm(name)
+        c.restoreState()
     @classmethod
     def _draw(self, c, x, y, width, draw_selections=None, enable=False):
         pos = y - 3 # leave room for 3pt top border
@@ -692,44 +968,31 @@ class InstructionsHeader:
             c.drawText(txto)
         pos -= gs.titleLeading
 
-        # TODO: configurable style instead of borrowing candsub style
         textx = x + 1 + (0.1 * inch)
-        availableWidth = width - (1 + (0.1 * inch))
-
-        bubbleImage = ImageReader(os.path.join(resources, self.image1))
-        imw, imh = bubbleImage.getSize()
-        imHeight = imh * (availableWidth / imw)
+        availableWidth = self._availableWidth(width)
+        bubbleHeight, i1h, w1h, writeInHeight, i2h = self._layout(width)
         if enable:
-            c.drawImage(bubbleImage, textx, pos - imHeight, availableWidth, imHeight)
-        pos -= imHeight
+            (i1par, _), (w1par, _), (i2par, _) = self._paragraphs(width)
 
-        ips = ParagraphStyle('instructionParagraph')
+        if enable:
+            c.drawImage(self._image(self.image1), textx, pos - bubbleHeight, availableWidth, bubbleHeight)
+        pos -= bubbleHeight
 
-        i1par = Paragraph(self.instruction1, ips)
-        ww, wh = i1par.wrap(availableWidth, 100)
         if enable:
-            i1par.drawOn(c, textx, pos-wh)
-        pos -= wh
-        # TODO: warning style
-        i1par = Paragraph(self.warning1, ips)
-        ww, wh = i1par.wrap(availableWidth, 100)
+            i1par.drawOn(c, textx, pos-i1h)
+        pos -= i1h
         if enable:
-            i1par.drawOn(c, textx, pos-wh)
-        pos -= wh
+            w1par.drawOn(c, textx, pos-w1h)
+        pos -= w1h
         pos -= gs.candsubLeading
 
-        writeInIm = ImageReader(os.path.join(resources, self.image2))
-        imw, imh = writeInIm.getSize()
-        imHeight = imh * (availableWidth / imw)
         if enable:
-            c.drawImage(writeInIm, textx, pos - imHeight, availableWidth, imHeight)
-        pos -= imHeight
+            c.drawImage(self._image(self.image2), textx, pos - writeInHeight, availableWidth, writeInHeight)
+        pos -= writeInHeight
 
-        i1par = Paragraph(self.instruction2, ips)
-        ww, wh = i1par.wrap(availableWidth, 100)
         if enable:
-            i1par.drawOn(c, textx, pos-wh)
-        pos -= wh
+            i2par.drawOn(c, textx, pos-i2h)
+        pos -= i2h
 
         pos -= 0.1 * inch # bottom padding
 
@@ -755,11 +1018,11 @@ class Header:
     _optional_fields = (
         ('ExternalIdentifier', []),
     )
+    __slots__ = ('Name', 'impl')
     def __init__(self, erctx, header_json_object):
         co = header_json_object
-        self.co = co
         self.Name = co['Name']
-        setOptionalFields(self, self.co)
+        setOptionalFields(self, co)
         self.impl = None
         if self.Name == 'Instructions':
             self.impl = InstructionsHeader
@@ -791,34 +1054,68 @@ def rehydrateContest(election, contest_json_object):
         raise Exception('unknown contest type {!r}'.format(cotype))
 
 class OrderedContest:
+    # one per contest per ballot style, there may be very many of these
+    __slots__ = ('contest', 'atid', 'draw_selections', 'allSelections', '_bubbles', '_heights')
     def __init__(self, erctx, contest_json_object):
         co = contest_json_object
-        self.co = co
         self.contest = erctx.getDrawOb(co['ContestId'])
         self.atid = co['ContestId']
-        # selection_ids refs by id to PartySelection, BallotMeasureSelection, CandidateSelection; TODO: dereference, where do they come from?
-        raw_selections = self.contest.ContestSelection
+        # selection_ids refs by id to PartySelection, BallotMeasureSelection, CandidateSelection of this contest
         selection_ids = co.get('OrderedContestSelectionIds', [])
         # because we might shuffle the candidate presentation order on different ballots:
         if selection_ids:
-            self.ordered_selections = [byId(raw_selections, x) for x in selection_ids]
+            self.draw_selections = erctx.orderedSelections(self.atid, selection_ids)
         else:
-            self.ordered_selections = raw_selections
-        self.draw_selections = [erctx.makeDrawOb(x) for x in self.ordered_selections]
+            self.draw_selections = self.contest.draw_selections
+        # heights don't depend on selection order, use the contest's memo if these are all its selections
+        self.allSelections = (len(self.draw_selections) == len(self.contest.draw_selections)) and (set(map(id, self.draw_selections)) == set(map(id, self.contest.draw_selections)))
+        self._bubbles = None
+        self._heights = None
     def _maxheight(self, width):
         return self.contest._maxheight(width, draw_selections=self.draw_selections)
     def height(self, width):
-        return self.contest.height(width, draw_selections=self.draw_selections)
+        if self.allSelections:
+            return self.contest.height(width)
+        return _memoHeight(self, width, lambda: self.contest.height(width, draw_selections=self.draw_selections))
+    def formName(self, width):
+        "PDF form XObject name for this contest in this selection order at this width"
+        key = json.dumps([self.atid, [ds.atid for ds in self.draw_selections], width, gs.fingerprint()])
+        return 'contest' + hashlib.sha1(key.encode()).hexdigest()[:20]
     def draw(self, c, x, y, width):
-        self.contest.draw(c, x, y, width, draw_selections=self.draw_selections)
-        return
+        if not gs.contestForms:
+            self.contest.draw(c, x, y, width, draw_selections=self.draw_selections)
+            self._bubbles = {ch.atid:ch._bubbleCoords for ch in self.draw_selections}
+            return
+        # {form name: {selection @id: bubble coords relative to form origin}, ...}
+        formBubbles = getattr(c, '_contestFormBubbles', None)
+        if formBubbles is None:
+            formBubbles = {}
+            c._contestFormBubbles = formBubbles
+        name = self.formName(width)
+        localBubbles = formBubbles.get(name)
+        if localBubbles is None:
+            # form origin is the contest's top,left
+            # long text may run past width, don't clip it short of the page edge
+            height = self.height(width)
+            c.beginForm(name, lowerx=-2, lowery=-(height+2), upperx=gs.pagesize[0], uppery=2)
+            self.contest.draw(c, 0, 0, width, draw_selections=self.draw_selections)
+            c.endForm()
+            localBubbles = {ch.atid:ch._bubbleCoords for ch in self.draw_selections}
+            formBubbles[name] = localBubbles
+        c.saveState()
+        c.translate(x, y)
+        c.doForm(name)
+        c.restoreState()
+        self._bubbles = {
+            atid:(bx + x, by + y, bw, bh) for atid, (bx, by, bw, bh) in localBubbles.items()
+        }
     def getBubbles(self):
-        return {ch.atid:ch._bubbleCoords for ch in self.draw_selections}
+        return self._bubbles
 
 class OrderedHeader:
+    __slots__ = ('header', 'atid')
     def __init__(self, erctx, contest_json_object):
         co = contest_json_object
-        self.co = co
         self.header = erctx.getDrawOb(co['HeaderId'])
         self.atid = co['HeaderId']
         # TODO: handle recursive OrderedContest,OrderedHeader entries in subordinate OrderedContent array
@@ -833,11 +1130,82 @@ class OrderedHeader:
         return None
 
 
+class ContentPlacement:
+    "one OrderedContent item positioned by BallotStyle.layout()"
+    __slots__ = ('content', 'page', 'column', 'x', 'y', 'width', 'height')
+    def __init__(self, content, page, column, x, y, width, height):
+        self.content = content # OrderedContest or OrderedHeader
+        self.page = page # 1 based
+        self.column = column # 1 based
+        # x,y is top,left
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+    def asdict(self):
+        return {
+            'atid': self.content.atid,
+            'page': self.page,
+            'column': self.column,
+            'x': self.x,
+            'y': self.y,
+            'width': self.width,
+            'height': self.height,
+        }
+
+class BallotPage:
+    "one page of a BallotLayout"
+    __slots__ = ('page', 'headerBox', 'placements')
+    def __init__(self, page, headerBox):
+        self.page = page # 1 based
+        # headerBox (left, top, right, bottom)
+        self.headerBox = headerBox
+        self.placements = []
+
+class BallotLayout:
+    """Result of BallotStyle.layout()
+
+    Everything needed to draw a BallotStyle without measuring anything again.
+    """
+    def __init__(self, pagesize, columns, columnwidth):
+        self.pagesize = pagesize
+        self.columns = columns
+        self.columnwidth = columnwidth
+        # content area of the page, before page header or nowstr
+        self.contentleft = None
+        self.contentright = None
+        self.contenttop = None
+        self.contentbottom = None
+        self.pages = []
+    @property
+    def numPages(self):
+        return len(self.pages)
+    def placements(self):
+        for bp in self.pages:
+            for pl in bp.placements:
+                yield pl
+    def getHeaderBoxes(self):
+        return {bp.page:bp.headerBox for bp in self.pages}
+    def asdict(self):
+        return {
+            'pagesize': self.pagesize,
+            'columns': self.columns,
+            'columnwidth': self.columnwidth,
+            'numPages': self.numPages,
+            'headers': self.getHeaderBoxes(),
+            'placements': [pl.asdict() for pl in self.placements()],
+        }
+
+
 class BallotStyle:
+    __slots__ = (
+        'erctx', 'gpunitIds', 'gpunits', 'ext', 'image_uri', 'content', 'parties',
+        '_numPages', '_pageHeader', '_bubbles', '_headerBoxes', '_layout',
+    )
     def __init__(self, erctx, ballotstyle_json_object):
         bs = ballotstyle_json_object
-        self.bs = bs
         self.erctx = erctx
+        self.gpunitIds = bs['GpUnitIds']
         self.gpunits = [erctx.getRawOb(x) for x in bs['GpUnitIds']]
         self.ext = bs.get('ExternalIdentifier', [])
         # image_uri is to image of example ballot?
@@ -845,15 +1213,12 @@ class BallotStyle:
         self.content = [erctx.makeDrawOb(ob) for ob in bs.get('OrderedContent', [])]
         # e.g. for a party-specific primary ballot (may associate with multiple parties)
         self.parties = [erctx.getRawOb(x) for x in bs.get('PartyIds', [])]
-        # _numPages gets filled in on a first rendering pass and used on second pass
+        # _numPages gets filled in by layout() and used in page header text
         self._numPages = 'X'
         self._pageHeader = bs.get('PageHeader') # extension field
         self._bubbles = None
         self._headerBoxes = {}
-        self.contenttop = None
-        self.contentbottom = None
-        self.contentleft = None
-        self.contentright = None
+        self._layout = None
     def select(self, selectors):
         for sel in selectors:
             if sel in self.ext:
@@ -882,121 +1247,191 @@ class BallotStyle:
             election.electionTypeTitle(), gpunitnames, datepart) + ' - page {PAGE} of {PAGES}'
         self._pageHeader = text
         return self._pageHeader
-    def drawPageHeader(self, c, page):
+    def pageHeaderHeight(self):
+        nlines = len(self.pageHeaderTemplate().splitlines())
+        return gs.headerLeading * nlines + 0.1*inch
+    def drawPageHeader(self, c, layout, page):
         c.setStrokeColorRGB(0,0,0)
         c.setLineWidth(1.0)
-        c.line(self.contentleft, self.contenttop, self.contentright, self.contenttop)
-        txto = c.beginText(self.contentleft + 0.1*inch, self.contenttop - gs.headerFontSize)
+        c.line(layout.contentleft, layout.contenttop, layout.contentright, layout.contenttop)
+        txto = c.beginText(layout.contentleft + 0.1*inch, layout.contenttop - gs.headerFontSize)
         txto.setFont(gs.headerFontName, gs.headerFontSize, gs.headerLeading)
-        headerText = self.pageHeaderText(page)
-        nlines = len(headerText.splitlines())
-        txto.textLines(headerText)
+        txto.textLines(self.pageHeaderText(page))
         c.drawText(txto)
-        pageHeaderHeight = gs.headerLeading * nlines + 0.1*inch
-        #self._pageHeaderHeight = max(pageHeaderHeight, self._pageHeaderHeight)
-        box = (self.contentleft + 0.1*inch, self.contenttop,
-               self.contentright, self.contenttop - pageHeaderHeight)
-        logger.debug('bs (%r) page %s box %r', self.bs['GpUnitIds'], page, box)
-        self._headerBoxes[page] = box
-        self.contenttop -= pageHeaderHeight
 
     def name(self):
         return ','.join([gpunitName(gpu) for gpu in self.gpunits])
-    def draw(self, c, pagesize):
-        widthpt, heightpt = pagesize
-        self.contenttop = heightpt - gs.pageMargin
-        self.contentbottom = gs.pageMargin
-        self.contentleft = gs.pageMargin
-        self.contentright = widthpt - gs.pageMargin
-        y = self.contenttop
-        x = self.contentleft
-        page = 1
-        if gs.debugPageOutline:
-            # draw page outline debug, a red border at content limit
-            c.setLineWidth(0.2)
-            c.setFillColorRGB(1,1,1)
-            c.setStrokeColorRGB(1,.6,.6)
-            c.rect(self.contentleft, self.contentbottom, widthpt - (2 * gs.pageMargin), heightpt - (2 * gs.pageMargin), stroke=1, fill=0)
-            c.setLineWidth(1)
-        nowstr = 'generated ' + time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime())
-        c.setTitle('ballot test ' + nowstr)
-        if gs.nowstrEnabled:
-            c.setFillColorRGB(0,0,0)
-            c.setStrokeColorRGB(0,0,0)
-            dtw = pdfmetrics.stringWidth(nowstr, gs.nowstrFontName, gs.nowstrFontSize)
-            c.setFont(gs.nowstrFontName, gs.nowstrFontSize)
-            c.drawString(self.contentright - dtw, self.contentbottom + (gs.nowstrFontSize * 0.2), nowstr)
-            self.contentbottom += (gs.nowstrFontSize * 1.2)
-
-        self.drawPageHeader(c, page)
-        # TODO: instruction box
-        y = self.contenttop
+    def layout(self, pagesize):
+        """Measure and place all content. Returns BallotLayout.
 
+        Does not need a canvas. draw() can then emit a style in one pass.
+        """
+        widthpt, heightpt = pagesize
         # (columnwidth * columns) + (gs.columnMargin * (columns - 1)) == width
         columns = 3
-        columnwidth = (self.contentright - self.contentleft - (gs.columnMargin * (columns - 1))) / columns
-        bubbles = {}
-        # content, 2 columns
+        contentleft = gs.pageMargin
+        contentright = widthpt - gs.pageMargin
+        columnwidth = (contentright - contentleft - (gs.columnMargin * (columns - 1))) / columns
+        lay = BallotLayout(pagesize, columns, columnwidth)
+        lay.contentleft = contentleft
+        lay.contentright = contentright
+        lay.contenttop = heightpt - gs.pageMargin
+        lay.contentbottom = gs.pageMargin
+        pageHeaderHeight = self.pageHeaderHeight()
+        headerBox = (contentleft + 0.1*inch, lay.contenttop,
+                     contentright, lay.contenttop - pageHeaderHeight)
+        contenttop = lay.contenttop - pageHeaderHeight
+        contentbottom = lay.contentbottom
+        if gs.nowstrEnabled:
+            # first page only
+            contentbottom += (gs.nowstrFontSize * 1.2)
+
+        page = 1
+        bp = BallotPage(page, headerBox)
+        lay.pages.append(bp)
+        x = contentleft
+        y = contenttop
         colnum = 1
         for xc in self.content:
             height = xc.height(columnwidth)
-            if y - height < self.contentbottom:
+            if y - height < contentbottom:
                 # start a new column
-                y = self.contenttop
+                y = contenttop
                 colnum += 1
                 if (colnum > columns) or (height == _PAGE_BREAK_HEIGHT):
                     # start a new page
-                    c.showPage()
                     page += 1
                     colnum = 1
-                    # reset contenttop for prior header
-                    self.contenttop = heightpt - gs.pageMargin
                     # reset contentbottom in case of debug string
-                    self.contentbottom = gs.pageMargin
-                    self.drawPageHeader(c, page)
-                    x = self.contentleft
-                    y = self.contenttop
+                    contentbottom = lay.contentbottom
+                    bp = BallotPage(page, headerBox)
+                    lay.pages.append(bp)
+                    x = contentleft
                 else:
                     x += columnwidth + gs.columnMargin
             if (height == _COLUMN_BREAK_HEIGHT) or (height == _PAGE_BREAK_HEIGHT):
                 # no actual content
                 continue
             # TODO: wrap super long issues
-            xc.draw(c, x, y, columnwidth)
+            bp.placements.append(ContentPlacement(xc, page, colnum, x, y, columnwidth, height))
             y -= height
             y += 1 # bottom border and top border may overlap
-            xb = xc.getBubbles()
-            if xb:
-                #logger.info('xc %r %s bubbles %r', xc, xc.atid, xb)
-                #bubbles.append(xb)
-                bubbles[xc.atid] = xb
+        self._numPages = lay.numPages
+        self._headerBoxes = lay.getHeaderBoxes()
+        for p, box in self._headerBoxes.items():
+            logger.debug('bs (%r) page %s box %r', self.gpunitIds, p, box)
+        self._layout = lay
+        return lay
+    def draw(self, c, pagesize, layout=None):
+        if layout is None:
+            layout = self.layout(pagesize)
+        widthpt, heightpt = pagesize
+        if gs.debugPageOutline:
+            # draw page outline debug, a red border at content limit
+            c.setLineWidth(0.2)
+            c.setFillColorRGB(1,1,1)
+            c.setStrokeColorRGB(1,.6,.6)
+            c.rect(layout.contentleft, layout.contentbottom, widthpt - (2 * gs.pageMargin), heightpt - (2 * gs.pageMargin), stroke=1, fill=0)
+            c.setLineWidth(1)
+        nowstr = 'generated ' + time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(self.erctx.eprinter.drawTime()))
+        c.setTitle('ballot test ' + nowstr)
+        if gs.nowstrEnabled:
+            c.setFillColorRGB(0,0,0)
+            c.setStrokeColorRGB(0,0,0)
+            dtw = pdfmetrics.stringWidth(nowstr, gs.nowstrFontName, gs.nowstrFontSize)
+            c.setFont(gs.nowstrFontName, gs.nowstrFontSize)
+            c.drawString(layout.contentright - dtw, layout.contentbottom + (gs.nowstrFontSize * 0.2), nowstr)
+
+        bubbles = {}
+        for bp in layout.pages:
+            if bp.page > 1:
+                c.showPage()
+            self.drawPageHeader(c, layout, bp.page)
+            for pl in bp.placements:
+                xc = pl.content
+                xc.draw(c, pl.x, pl.y, pl.width)
+                xb = xc.getBubbles()
+                if xb:
+                    bubbles[xc.atid] = xb
         c.showPage()
-        self._numPages = page
         self._bubbles = bubbles
     def getBubbles(self):
         return self._bubbles
     def getHeaderBoxes(self):
         return self._headerBoxes
+    def getLayout(self):
+        return self._layout
+
 
 
+def _countDrawn(numPages):
+    t = timings()
+    if t is not None:
+        t.count('styles')
+        t.count('pages', numPages)
+
+def _reportTime(text):
+    "ElectionReport GeneratedDate to unix time, 0 if missing or unparseable"
+    if not text:
+        return 0
+    try:
+        dt = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        logger.warning('bad GeneratedDate %r', text)
+        return 0
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+def _newCanvas(out, drawTime):
+    c = canvas.Canvas(out, pagesize=gs.pagesize, invariant=gs.deterministic) # pageCompression=1
+    if gs.deterministic:
+        # invariant mode fixes the document id; put the report's time in CreationDate and ModDate
+        ts = pdfdoc.TimeStamp(invariant=True)
+        ts.t = drawTime
+        ts.lt = time.gmtime(drawTime)
+        ts.YMDhms = tuple(ts.lt)[:6]
+        c._doc._timeStamp = ts
+    return c
 
 def gatherIds(ob):
-    out = dict()
-    _gatherIds(out, ob)
-    return out
-def _gatherIds(out, ob):
-    if isinstance(ob, dict):
-        dtype = ob.get('@type')
-        did = ob.get('@id')
-        if dtype is not None and did is not None:
-            if did in out:
-                raise Exception('@id collision {!r} for {!r} and {!r}'.format(did, out[did], ob))
-            out[did] = ob
-        for k, v in ob.items():
-            _gatherIds(out, v)
-    elif isinstance(ob, (list,tuple)):
-        for x in ob:
-            _gatherIds(out, x)
+    "{@id: ob, ...} for every object in ob with @type and @id"
+    return indexIds(ob)[0]
+
+def indexIds(ob):
+    """One iterative pass over a json tree.
+
+    Returns ({@id: ob}, {@type: [ob, ...]}, {contest @id: {selection @id: ob}}).
+    """
+    byid = {}
+    bytype = {}
+    bycontest = {}
+    # (json value, @id of enclosing contest or None)
+    stack = [(ob, None)]
+    while stack:
+        ob, contestId = stack.pop()
+        if isinstance(ob, dict):
+            dtype = ob.get('@type')
+            did = ob.get('@id')
+            if dtype is not None and did is not None:
+                if did in byid:
+                    raise Exception('@id collision {!r} for {!r} and {!r}'.format(did, byid[did], ob))
+                byid[did] = ob
+                bytype.setdefault(dtype, []).append(ob)
+                if contestId is not None:
+                    bycontest.setdefault(contestId, {})[did] = ob
+                    contestId = None
+                if 'ContestSelection' in ob:
+                    contestId = did
+            for k, v in ob.items():
+                if (contestId is not None) and (k != 'ContestSelection'):
+                    stack.append((v, None))
+                else:
+                    stack.append((v, contestId))
+        elif isinstance(ob, (list,tuple)):
+            for x in reversed(ob):
+                stack.append((x, contestId))
+    return byid, bytype, bycontest
 
 CandidateType = 'ElectionResults.Candidate'
 CandidateContestType = 'ElectionResults.CandidateContest'
@@ -1025,11 +1460,27 @@ class ElectionResultsContext:
         self.er = election_results_json_object
         self.eprinter = eprinter # ElectionPrinter{}
         # obids = {@id: json ob, ...}
-        self.obids = gatherIds(self.er)
+        # obtypes = {@type: [json ob, ...], ...}
+        # contestSelections = {contest @id: {selection @id: json ob, ...}, ...}
+        self.obids, self.obtypes, self.contestSelections = indexIds(self.er)
         # draw objects by id, same key as obids
         self.dobs = {}
+        # {(contest @id, (selection @id, ...)): (selection draw ob, ...)}
+        self._orders = {}
     def getRawOb(self, id_string):
         return self.obids[id_string]
+    def getRawObsOfType(self, typestring):
+        return self.obtypes.get(typestring, [])
+    def getContestSelection(self, contest_id, selection_id):
+        return self.contestSelections.get(contest_id, {})[selection_id]
+    def orderedSelections(self, contest_id, selection_ids):
+        "tuple of selection draw objects, shared by every ballot style with the same order"
+        key = (contest_id, tuple(selection_ids))
+        out = self._orders.get(key)
+        if out is None:
+            out = tuple([self.makeDrawOb(self.getContestSelection(contest_id, x)) for x in selection_ids])
+            self._orders[key] = out
+        return out
     def getDrawOb(self, id_string):
         dob = self.dobs.get(id_string)
         if dob is None:
@@ -1071,7 +1522,8 @@ class ElectionPrinter:
         # election ElectionResults.Election from json
         er = election_report
         el = election
-        erctx = ElectionResultsContext(er, self)
+        with phase('context'):
+            erctx = ElectionResultsContext(er, self)
         self.erctx = erctx
         self.er = er
         self.el = el
@@ -1082,24 +1534,33 @@ class ElectionPrinter:
         self.election_type = el['Type']
         self.election_type_other = el.get('OtherType')
         self.ext = er.get('ExternalIdentifier', [])
+        # when this revision of the report was made, for deterministic drawing
+        self.generated = _reportTime(er.get('GeneratedDate'))
         self.contests = el.get('Contest', [])
         self.candidates = el.get('Candidate', [])
         # ballot_styles is local BallotStyle objects
         self.ballot_styles = []
-        for bstyle in el.get('BallotStyle', []):
-            self.ballot_styles.append(BallotStyle(erctx,bstyle))
+        with phase('context'):
+            for bstyle in el.get('BallotStyle', []):
+                self.ballot_styles.append(BallotStyle(erctx,bstyle))
         return
+    def drawTime(self):
+        "time to stamp on drawn ballots"
+        if gs.deterministic:
+            return self.generated
+        return time.time()
     def electionTypeTitle(self):
         # TODO: i18n
         if self.election_type == 'other':
             return self.election_type_other
         return _election_types_en[self.election_type]
 
-    def drawToDir(self, outdir, outname_prefix=None, selectors=None):
+    def drawToDir(self, outdir, outname_prefix=None, selectors=None, jobs=1):
         outpaths = []
         _ensure_fonts()
         if outname_prefix is None:
             outname_prefix = self.name + '_'
+        todo = []
         for i, bs in enumerate(self.ballot_styles):
             if (selectors is not None) and not bs.select(selectors):
                 continue
@@ -1110,40 +1571,58 @@ class ElectionPrinter:
                 bs_fname = '{}{}.pdf'.format(outname_prefix, names)
             if outdir:
                 bs_fname = os.path.join(outdir, bs_fname)
-            # dummy draw for pagination
-            outdummy = io.BytesIO()
-            dc = canvas.Canvas(outdummy, pagesize=gs.pagesize)
-            bs.draw(dc, gs.pagesize)
-            outdummy = None
-            dc = None
-            # real draw
             outpaths.append(bs_fname)
-            c = canvas.Canvas(bs_fname, pagesize=gs.pagesize) # pageCompression=1
-            bs.draw(c, gs.pagesize)
-            c.save()
+            todo.append((i, bs_fname))
+        if jobs > 1 and len(todo) > 1:
+            for _ in self._drawParallel(todo, jobs):
+                pass
+            return outpaths
+        for i, bs_fname in todo:
+            _drawBallotStyle(self.ballot_styles[i], bs_fname)
         return outpaths
 
     def drawToFile(self, outfile=None, selectors=None):
+        """Draw selected BallotStyles into one PDF.
+
+        Always on one canvas in this process. Drawing chunks of styles in
+        worker processes and merging them with pypdf was slower than drawing
+        them all here, even before process startup, so use drawToDir(jobs=N)
+        to spread styles over cores.
+        """
         # TODO: one specific ballot style or all of them to separate PDFs
         _ensure_fonts()
-        any = False
-        c = canvas.Canvas(outfile, pagesize=gs.pagesize) # pageCompression=1
+        todo = []
         for i, bs in enumerate(self.ballot_styles):
             if (selectors is not None) and not bs.select(selectors):
                 continue
-            any = True
-            # dummy draw for pagination
-            outdummy = io.BytesIO()
-            dc = canvas.Canvas(outdummy, pagesize=gs.pagesize)
-            bs.draw(dc, gs.pagesize)
-            outdummy = None
-            dc = None
-            # real draw
-            bs.draw(c, gs.pagesize)
-        if any:
-            c.save()
-        else:
+            todo.append(i)
+        if not todo:
             raise Exception('No BallotStyles drawn for selectors {!r}'.format(selectors))
+        c = _newCanvas(outfile, self.drawTime())
+        for i in todo:
+            _drawStyle(c, self.ballot_styles[i])
+        with phase('save'), _save_lock:
+            c.save()
+
+    def _drawParallel(self, todo, jobs):
+        """Draw BallotStyles to their own PDF files in worker processes.
+
+        todo is [(ballot style index, pdf path), ...]
+        Yields once per style, in todo order.
+        Bubbles and header boxes are copied back onto local BallotStyle objects.
+        """
+        jobs = min(jobs, len(todo))
+        chunksize = max(1, len(todo) // (jobs * 4))
+        initargs = (self.er, self.el, dict(gs.__dict__))
+        with multiprocessing.Pool(jobs, initializer=_worker_init, initargs=initargs) as pool:
+            for i, bubbles, headerBoxes, numPages in pool.imap(_worker_draw, todo, chunksize):
+                bs = self.ballot_styles[i]
+                bs._bubbles = bubbles
+                bs._headerBoxes = headerBoxes
+                bs._numPages = numPages
+                _countDrawn(numPages)
+                yield i
+
     def getBubbles(self):
         """{
 "pagesize": (width pt, height pt),
@@ -1160,7 +1639,7 @@ class ElectionPrinter:
         bsdata = []
         for bs in self.ballot_styles:
             ob = {
-                'GpUnitIds': bs.bs['GpUnitIds'],
+                'GpUnitIds': bs.gpunitIds,
                 'bubbles': bs.getBubbles(),
                 'headers': bs.getHeaderBoxes(),
             }
@@ -1174,12 +1653,35 @@ class ElectionPrinter:
             'headers': [bs.getHeaderBoxes() for bs in self.ballot_styles],
         }
 
-# for a list of NIST-1500-100 v2 json/dict objects with "@id" keys, return one
-def byId(they, x):
-    for y in they:
-        if y['@id'] == x:
-            return y
-    raise KeyError(x)
+# ElectionPrinter for this worker process, set up by _worker_init()
+_worker_printer = None
+
+def _worker_init(election_report, election, settings):
+    "multiprocessing.Pool initializer for ElectionPrinter._drawParallel"
+    global _worker_printer
+    gs.__dict__.update(settings)
+    _ensure_fonts()
+    _worker_printer = ElectionPrinter(election_report, election)
+
+def _worker_draw(task):
+    i, outpath = task
+    bs = _worker_printer.ballot_styles[i]
+    _drawBallotStyle(bs, outpath)
+    return i, bs.getBubbles(), bs.getHeaderBoxes(), bs._numPages
+
+def _drawBallotStyle(bs, outpath):
+    "draw one BallotStyle as its own PDF"
+    c = _newCanvas(outpath, bs.erctx.eprinter.drawTime())
+    _drawStyle(c, bs)
+    with phase('save'), _save_lock:
+        c.save()
+
+def _drawStyle(c, bs):
+    with phase('layout'):
+        lay = bs.layout(gs.pagesize)
+    with phase('draw'):
+        bs.draw(c, gs.pagesize, lay)
+    _countDrawn(lay.numPages)
 
 def main():
     import argparse
@@ -1189,7 +1691,12 @@ def main():
     ap.add_argument('--verbose', default=False, action='store_true')
     ap.add_argument('--outdir', default=None)
     ap.add_argument('--prefix', default='')
+    ap.add_argument('--jobs', type=int, default=1, help='number of worker processes to draw ballot styles in')
+    ap.add_argument('--deterministic', default=False, action='store_true', help='same input, same PDF bytes')
+    ap.add_argument('--profile', default=None, help='write sampled stacks of this process in collapsed format (flamegraph.pl, speedscope) to path')
+    ap.add_argument('--profile-hz', type=int, default=100, help='stack samples per second for --profile')
     args = ap.parse_args()
+    gs.deterministic = args.deterministic
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
     else:
@@ -1199,9 +1706,14 @@ def main():
     else:
         with open(args.election_json) as fin:
             er = json.load(fin)
+    sampler = None
+    if args.profile:
+        sampler = StackSampler(1.0 / max(1, args.profile_hz))
+        sampler.start()
+    t = timingsStart()
     for el in er.get('Election', []):
         ep = ElectionPrinter(er, el)
-        fnames_written = ep.drawToDir(args.outdir, args.prefix)
+        fnames_written = ep.drawToDir(args.outdir, args.prefix, jobs=args.jobs)
         sys.stdout.write(', '.join(fnames_written) + '\n')
         if args.bubbles:
             if args.bubbles == '-':
@@ -1211,6 +1723,13 @@ def main():
             json.dump(ep.getBubbles(), bout)
             bout.write('\n')
             bout.close()
+    timingsStop()
+    if sampler is not None:
+        sampler.stop()
+        with open(args.profile, 'w') as fout:
+            fout.write(sampler.collapsed())
+        logger.info('%d stack samples written to %s', sampler.samples, args.profile)
+    logger.info('%d styles, %d pages; %s', t.counts.get('styles', 0), t.counts.get('pages', 0), ', '.join('{} {:.0f}ms'.format(k, v*1000) for k, v in t.seconds.items()))
     return
 
 if __name__ == '__main__':
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# python3 -m unittest draw.draw_test
+# (run from a directory with resources/, or from the top of the repo)
+
+import concurrent.futures
+import io
+import sys
+import unittest
+
+from . import draw
+from . import synth
+
+THREADS = 6
+RENDERS = 40
+
+@unittest.skipIf(draw.resources is None, 'no resources/ directory with fonts and images')
+class ThreadedRenderTest(unittest.TestCase):
+    """the draw server renders from several threads at once
+
+    Relies on draw._save_lock: reportlab's font subsetting in canvas.save()
+    is not thread safe by itself.
+    """
+    def setUp(self):
+        self.er = synth.generate(contests=6, candidates=3, styles=12)
+        self.forms = draw.gs.contestForms
+        # switch threads often so that unsafe sharing shows up
+        self.switch = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+    def tearDown(self):
+        draw.gs.contestForms = self.forms
+        sys.setswitchinterval(self.switch)
+
+    def _render(self, i, er=None):
+        er = er or self.er
+        ep = draw.ElectionPrinter(er, er['Election'][0])
+        out = io.BytesIO()
+        ep.drawToFile(outfile=out)
+        return len(out.getvalue())
+
+    def _renderMany(self, er=None, renders=RENDERS):
+        draw.InstructionsHeader._layouts.clear()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=THREADS) as pool:
+            sizes = list(pool.map(lambda i: self._render(i, er), range(renders)))
+        self.assertTrue(all(sizes))
+
+    def test_forms(self):
+        draw.gs.contestForms = True
+        self._renderMany()
+
+    def test_noforms(self):
+        draw.gs.contestForms = False
+        self._renderMany()
+
+    def test_saves(self):
+        # small PDFs, so most of the time goes to overlapping saves
+        self._renderMany(synth.generate(contests=4, candidates=3, styles=1), 300)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,11 @@ type DrawBothOb struct {
 	BubblesJson []byte
 }
 
+// FramesMimetype is the Content-Type of a /draw?both=1 response sent as
+// length-prefixed binary frames: bubbles json then pdf.
+// Each frame is an 8 byte big-endian length then that many bytes.
+const FramesMimetype = "application/x-ballotstudio-frames"
+
 type DrawBothResponse struct {
 	PdfB64  []byte                 `json:"pdfb64"`
 	Bubbles map[string]interface{} `json:"bubbles"`
@@ -82,10 +87,18 @@ func DrawElection(backendUrl string, electionjson string) (both *DrawBothOb, err
 	nurl.RawQuery = "both=1"
 	drawurl := nurl.String()
 	postbody := strings.NewReader(electionjson)
-	resp, err := http.DefaultClient.Post(drawurl, "application/json", postbody)
+	req, err := http.NewRequest("POST", drawurl, postbody)
+	if err != nil {
+		return nil, fmt.Errorf("draw POST, %v", err)
+	}
+	req.Header.Set("Content-Type", "application/json")
+	// older draw servers ignore this and send json
+	req.Header.Set("Accept", FramesMimetype+", application/json;q=0.5")
+	resp, err := http.DefaultClient.Do(req)
 	if err != nil {
 		return nil, fmt.Errorf("draw POST, %v", err)
 	}
+	defer resp.Body.Close()
 	if resp.StatusCode != 200 {
 		body, _ := ioutil.ReadAll(resp.Body)
 		if len(body) > 50 {
@@ -93,6 +106,13 @@ func DrawElection(backendUrl string, electionjson string) (both *DrawBothOb, err
 		}
 		return nil, fmt.Errorf("draw POST %d %#v", resp.StatusCode, string(body))
 	}
+	if strings.HasPrefix(resp.Header.Get("Content-Type"), FramesMimetype) {
+		frames, err := readFrames(resp.Body, 2)
+		if err != nil {
+			return nil, fmt.Errorf("draw POST bad response frames, %v", err)
+		}
+		return &DrawBothOb{Pdf: frames[1], BubblesJson: frames[0]}, nil
+	}
 	body, err := ioutil.ReadAll(resp.Body)
 	//dec := json.NewDecoder(resp.Body)
 	var dbr DrawBothResponse
@@ -127,6 +147,26 @@ func DrawElection(backendUrl string, electionjson string) (both *DrawBothOb, err
 	return &DrawBothOb{Pdf: dbr.PdfB64, BubblesJson: bj}, nil
 }
 
+// read exactly count frames of 8 byte big-endian length then that many bytes
+func readFrames(reader io.Reader, count int) (frames [][]byte, err error) {
+	var sizebytes [8]byte
+	frames = make([][]byte, 0, count)
+	for len(frames) < count {
+		_, err = io.ReadFull(reader, sizebytes[:])
+		if err != nil {
+			return nil, fmt.Errorf("reading frame[%d] size, %v", len(frames), err)
+		}
+		framelen := binary.BigEndian.Uint64(sizebytes[:])
+		frame := make([]byte, framelen)
+		_, err = io.ReadFull(reader, frame)
+		if err != nil {
+			return nil, fmt.Errorf("reading frame[%d], %v", len(frames), err)
+		}
+		frames = append(frames, frame)
+	}
+	return frames, nil
+}
+
 type errorOrPngbytes struct {
 	err      error
 	pngpages [][]byte
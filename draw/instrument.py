@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# Per thread timing of drawing phases, and a stack sampling profiler.
+#
+# Kept out of draw.py, whose source hash is the renderer version in
+# render cache keys and ETags.
+
+import os
+import sys
+import threading
+import time
+
+_renderer = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'draw.py')
+
+class Timings:
+    """Seconds spent in named phases of one request or run, and counts of styles and pages drawn.
+
+    Collected per thread between timingsStart() and timingsStop().
+    """
+    __slots__ = ('seconds', 'counts')
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0) + seconds
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+_timingsLocal = threading.local()
+
+def timingsStart():
+    t = Timings()
+    _timingsLocal.timings = t
+    return t
+
+def timingsStop():
+    t = getattr(_timingsLocal, 'timings', None)
+    _timingsLocal.timings = None
+    return t
+
+def timings():
+    "this thread's Timings or None"
+    return getattr(_timingsLocal, 'timings', None)
+
+class phase:
+    "with phase('layout'): ... adds to this thread's Timings. costs next to nothing when none is collecting."
+    __slots__ = ('name', 'timings', 'start')
+    def __init__(self, name):
+        self.name = name
+        self.timings = getattr(_timingsLocal, 'timings', None)
+    def __enter__(self):
+        if self.timings is not None:
+            self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        if self.timings is not None:
+            self.timings.add(self.name, time.perf_counter() - self.start)
+        return False
+
+class StackSampler:
+    """Samples every thread's stack into collapsed stacks for flamegraph tools.
+
+    Lines are "outer;...;inner count". Only stacks going through one of
+    paths (default draw.py, the renderer) are kept unless allThreads,
+    so idle threads don't show up. Nothing runs between start() and
+    stop(), so it costs nothing when not profiling.
+    """
+    def __init__(self, interval=0.01, exclude=(), allThreads=False, paths=None):
+        self.interval = interval
+        self.exclude = set(exclude)
+        self.allThreads = allThreads
+        self.paths = set(os.path.abspath(x) for x in (paths or (_renderer,)))
+        # {collapsed stack: samples}
+        self.counts = {}
+        self.samples = 0
+        # {code: (label, in paths)}
+        self._codes = {}
+        self._stop = threading.Event()
+        self._thread = None
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='StackSampler')
+        self._thread.daemon = True
+        self._thread.start()
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+    def _code(self, code):
+        lo = self._codes.get(code)
+        if lo is None:
+            label = '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+            lo = (label, os.path.abspath(code.co_filename) in self.paths)
+            self._codes[code] = lo
+        return lo
+    def _run(self):
+        exclude = self.exclude | {threading.get_ident()}
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid in exclude:
+                    continue
+                keep = self.allThreads
+                stack = []
+                while frame is not None:
+                    label, ours = self._code(frame.f_code)
+                    keep = keep or ours
+                    stack.append(label)
+                    frame = frame.f_back
+                if keep:
+                    key = ';'.join(reversed(stack))
+                    self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+    def collapsed(self):
+        return ''.join('{} {}\n'.format(k, v) for k, v in sorted(self.counts.items()))
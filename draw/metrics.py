@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+# In-process counters and histograms, written out in the Prometheus text format.
+#
+# Nothing is sent anywhere; something scrapes /metrics. Each process keeps
+# its own numbers, so under gunicorn every worker reports for itself.
+
+import math
+import threading
+
+# seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labelText(names, values, extra=None):
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+def _num(x):
+    if x == math.inf:
+        return '+Inf'
+    if isinstance(x, float) and x.is_integer():
+        return str(int(x))
+    return repr(x)
+
+class Counter:
+    "count of things that only go up, per combination of label values"
+    kind = 'counter'
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        # {(label value, ...): count}
+        self.values = {}
+    def inc(self, *labelvalues, n=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + n
+    def lines(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for lv, v in values:
+            yield '{}{} {}'.format(self.name, _labelText(self.labels, lv), _num(v))
+
+class Histogram:
+    "distribution of observed values (usually seconds) in cumulative buckets"
+    kind = 'histogram'
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.lock = threading.Lock()
+        # {(label value, ...): [[count per bucket], sum, count]}
+        self.values = {}
+    def observe(self, value, *labelvalues):
+        with self.lock:
+            h = self.values.get(labelvalues)
+            if h is None:
+                h = [[0] * len(self.buckets), 0.0, 0]
+                self.values[labelvalues] = h
+            for i, le in enumerate(self.buckets):
+                if value <= le:
+                    h[0][i] += 1
+                    break
+            h[1] += value
+            h[2] += 1
+    def lines(self):
+        with self.lock:
+            values = sorted((lv, (list(h[0]), h[1], h[2])) for lv, h in self.values.items())
+        for lv, (counts, total, count) in values:
+            cumulative = 0
+            for le, n in zip(self.buckets, counts):
+                cumulative += n
+                yield '{}_bucket{} {}'.format(self.name, _labelText(self.labels, lv, 'le="{}"'.format(_num(le))), cumulative)
+            yield '{}_sum{} {}'.format(self.name, _labelText(self.labels, lv), _num(total))
+            yield '{}_count{} {}'.format(self.name, _labelText(self.labels, lv), count)
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # callables returning [(name, kind, help, value), ...] read at scrape time
+        self.collectors = []
+    def counter(self, name, help, labels=()):
+        m = Counter(name, help, labels)
+        self.metrics.append(m)
+        return m
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        m = Histogram(name, help, labels, buckets)
+        self.metrics.append(m)
+        return m
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+    def text(self):
+        out = []
+        for m in self.metrics:
+            out.append('# HELP {} {}'.format(m.name, m.help))
+            out.append('# TYPE {} {}'.format(m.name, m.kind))
+            out.extend(m.lines())
+        for fn in self.collectors:
+            for name, kind, help, value in fn():
+                out.append('# HELP {} {}'.format(name, help))
+                out.append('# TYPE {} {}'.format(name, kind))
+                out.append('{} {}'.format(name, _num(value)))
+        out.append('')
+        return '\n'.join(out)
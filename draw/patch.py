@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# RFC 6902 JSON Patch with RFC 6901 JSON Pointer paths.
+#
+# apply() never changes the document it is given. Containers along each
+# patched path are copied and everything else is shared with the original,
+# so the cost of a patch scales with the edit, not the document.
+
+class PatchError(Exception):
+    "patch is malformed or can't be applied to this document"
+    pass
+
+class TestFailed(PatchError):
+    "a 'test' operation didn't match"
+    pass
+
+def parsePointer(pointer):
+    "'/a/b~1c' -> ['a', 'b/c']"
+    if not isinstance(pointer, str):
+        raise PatchError('pointer must be a string, got {!r}'.format(pointer))
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise PatchError('pointer must start with "/": {!r}'.format(pointer))
+    return [x.replace('~1', '/').replace('~0', '~') for x in pointer[1:].split('/')]
+
+def _index(container, token, pointer, allowEnd=False):
+    if token == '-' and allowEnd:
+        return len(container)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise PatchError('bad array index {!r} in {!r}'.format(token, pointer))
+    i = int(token)
+    limit = len(container) + 1 if allowEnd else len(container)
+    if i >= limit:
+        raise PatchError('array index {} out of range in {!r}'.format(i, pointer))
+    return i
+
+def _child(node, token, pointer):
+    if isinstance(node, dict):
+        if token not in node:
+            raise PatchError('no member {!r} in {!r}'.format(token, pointer))
+        return node[token]
+    if isinstance(node, list):
+        return node[_index(node, token, pointer)]
+    raise PatchError('{!r} goes through a non-container'.format(pointer))
+
+def get(doc, pointer):
+    node = doc
+    for token in parsePointer(pointer):
+        node = _child(node, token, pointer)
+    return node
+
+def _modify(node, tokens, pointer, fn):
+    "copy of node with fn() applied to a copy of the container at tokens"
+    if isinstance(node, dict):
+        node = dict(node)
+    elif isinstance(node, list):
+        node = list(node)
+    else:
+        raise PatchError('{!r} goes through a non-container'.format(pointer))
+    if not tokens:
+        fn(node)
+        return node
+    token = tokens[0]
+    if isinstance(node, dict):
+        if token not in node:
+            raise PatchError('no member {!r} in {!r}'.format(token, pointer))
+        key = token
+    else:
+        key = _index(node, token, pointer)
+    node[key] = _modify(node[key], tokens[1:], pointer, fn)
+    return node
+
+def _add(doc, pointer, value):
+    tokens = parsePointer(pointer)
+    if not tokens:
+        return value
+    last = tokens[-1]
+    def fn(container):
+        if isinstance(container, dict):
+            container[last] = value
+        else:
+            container.insert(_index(container, last, pointer, allowEnd=True), value)
+    return _modify(doc, tokens[:-1], pointer, fn)
+
+def _remove(doc, pointer):
+    tokens = parsePointer(pointer)
+    if not tokens:
+        raise PatchError('can not remove the whole document')
+    last = tokens[-1]
+    def fn(container):
+        if isinstance(container, dict):
+            if last not in container:
+                raise PatchError('no member {!r} in {!r}'.format(last, pointer))
+            del container[last]
+        else:
+            del container[_index(container, last, pointer)]
+    return _modify(doc, tokens[:-1], pointer, fn)
+
+def _replace(doc, pointer, value):
+    tokens = parsePointer(pointer)
+    if not tokens:
+        return value
+    last = tokens[-1]
+    def fn(container):
+        if isinstance(container, dict):
+            if last not in container:
+                raise PatchError('no member {!r} in {!r}'.format(last, pointer))
+            container[last] = value
+        else:
+            container[_index(container, last, pointer)] = value
+    return _modify(doc, tokens[:-1], pointer, fn)
+
+def _jsonEqual(a, b):
+    # json true is not 1
+    if isinstance(a, bool) or isinstance(b, bool):
+        return (type(a) is type(b)) and (a == b)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return (a.keys() == b.keys()) and all(_jsonEqual(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return (len(a) == len(b)) and all(_jsonEqual(x, y) for x, y in zip(a, b))
+    return a == b
+
+def _field(op, name):
+    if name not in op:
+        raise PatchError('{!r} operation missing {!r}'.format(op.get('op'), name))
+    return op[name]
+
+def apply(doc, ops):
+    "return a new document with the list of patch operations applied"
+    if not isinstance(ops, list):
+        raise PatchError('patch must be a list of operations')
+    for op in ops:
+        if not isinstance(op, dict):
+            raise PatchError('operation must be an object, got {!r}'.format(op))
+        name = op.get('op')
+        path = _field(op, 'path')
+        if name == 'add':
+            doc = _add(doc, path, _field(op, 'value'))
+        elif name == 'remove':
+            doc = _remove(doc, path)
+        elif name == 'replace':
+            doc = _replace(doc, path, _field(op, 'value'))
+        elif name == 'move':
+            src = _field(op, 'from')
+            srcTokens = parsePointer(src)
+            pathTokens = parsePointer(path)
+            if (len(pathTokens) > len(srcTokens)) and (pathTokens[:len(srcTokens)] == srcTokens):
+                raise PatchError('can not move {!r} into its own child {!r}'.format(src, path))
+            value = get(doc, src)
+            doc = _add(_remove(doc, src), path, value)
+        elif name == 'copy':
+            doc = _add(doc, path, get(doc, _field(op, 'from')))
+        elif name == 'test':
+            if not _jsonEqual(get(doc, path), _field(op, 'value')):
+                raise TestFailed('test failed at {!r}'.format(path))
+        else:
+            raise PatchError('unknown operation {!r}'.format(name))
+    return doc
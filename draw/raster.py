@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#
+# Rasterize PDF pages to PNG.
+# In process with PyMuPDF if installed (pip install pymupdf),
+# otherwise one poppler `pdftoppm -png` subprocess per page.
+
+import subprocess
+import threading
+
+try:
+    import pymupdf
+except ImportError:
+    try:
+        # PyMuPDF before 1.24
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+# how pageToPng() rasterizes, for metrics
+METHOD = 'pymupdf' if pymupdf is not None else 'pdftoppm'
+
+DEFAULT_DPI = 150 # same as pdftoppm default
+MIN_DPI = 10
+MAX_DPI = 600
+
+class PageOutOfRange(Exception):
+    pass
+
+# PyMuPDF is not thread safe, one render at a time
+_lock = threading.Lock()
+
+def clampDpi(dpi):
+    return max(MIN_DPI, min(MAX_DPI, int(dpi)))
+
+def pageToPng(pdfbytes, page=1, dpi=DEFAULT_DPI):
+    "render page (1 based) of pdf at dpi, return png bytes"
+    if page < 1:
+        raise PageOutOfRange(page)
+    dpi = clampDpi(dpi)
+    if pymupdf is not None:
+        return _mupdfPageToPng(pdfbytes, page, dpi)
+    return _pdftoppmPageToPng(pdfbytes, page, dpi)
+
+def _mupdfPageToPng(pdfbytes, page, dpi):
+    with _lock:
+        doc = pymupdf.open(stream=pdfbytes, filetype='pdf')
+        try:
+            if page > doc.page_count:
+                raise PageOutOfRange(page)
+            pix = doc[page-1].get_pixmap(dpi=dpi)
+            return pix.tobytes('png')
+        finally:
+            doc.close()
+
+def _pdftoppmPageToPng(pdfbytes, page, dpi):
+    cmd = ['pdftoppm', '-png', '-r', str(dpi), '-f', str(page), '-l', str(page)]
+    result = subprocess.run(cmd, input=pdfbytes, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if b'Wrong page range' in result.stderr:
+        raise PageOutOfRange(page)
+    result.check_returncode()
+    if not result.stdout:
+        raise PageOutOfRange(page)
+    return result.stdout
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import sqlite3
+
+# applied to every new connection
+default_pragmas = (
+    "PRAGMA synchronous=NORMAL", # safe with WAL, fsync on checkpoint not every commit
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000", # KiB
+)
+
+class ConnectionPool:
+    """Reusable sqlite3 connections, safe to share across threads.
+
+    A connection is used by one thread at a time: get() it, use it, put() it back.
+    Up to size idle connections are kept open. Each connection keeps its own
+    cache of prepared statements, so reusing connections reuses statements.
+    Don't use a pool across fork(); check pid and make a new pool in the child.
+    """
+    def __init__(self, path, size=8, pragmas=default_pragmas, cached_statements=256):
+        self.path = path
+        self.size = size
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=self.cached_statements)
+        for stmt in self.pragmas:
+            conn.execute(stmt)
+        return conn
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def put(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self.idle.qsize() >= self.size:
+            conn.close()
+            return
+        self.idle.put_nowait(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+#
+# Synthetic ElectionReport of any size for load and scale testing.
+#
+# Precincts are grouped into cities and counties. Contests are spread over
+# state, county and city districts, and each precinct's BallotStyle gets
+# every contest whose district contains it, so styles overlap the way real
+# ones do. The same seed always gives the same report.
+#
+# python3 -m draw.synth --styles 2000 --contests 60 | python3 draw/draw.py -
+
+import json
+import random
+import sys
+
+from . import demorace
+
+_first = ('Alex', 'Bea', 'Carmen', 'Dmitri', 'Esperanza', 'Fatima', 'Guo', 'Hiroshi', 'Ines', 'Jamal', 'Kateryna', 'Luis', 'Mei', 'Nkechi', 'Olusegun', 'Priya', 'Quentin', 'Rosalind', 'Siobhan', 'Tariq', 'Ursula', 'Vikram', 'Wilhelmina', 'Xiomara', 'Yusuf', 'Zoë')
+_last = ('Abernathy', 'Baptiste', 'Castellanos', 'Dubois', 'Eriksson', 'Fitzgerald', 'Gonzalez-Ortiz', 'Hakimi', 'Ivanova', 'Jablonski', 'Kowalczyk', 'Lindqvist', 'Montgomery', 'Nakamura', 'Okonkwo', 'Papadopoulos', 'Quispe', 'Rasmussen', 'Szymańska', 'Thorvaldsen', 'Uchenna', 'Vasquez', 'Washington', 'Xu', 'Yamamoto', 'Zielinski')
+_partyWords = ('Liberty', 'Green', 'Progress', 'Heritage', 'Union', 'Frontier', 'Harbor', 'Prairie', 'Summit', 'Commonwealth', 'Reform', 'Independence')
+_offices = ('Commissioner', 'Treasurer', 'Auditor', 'Assessor', 'Clerk', 'Sheriff', 'Judge', 'Trustee', 'Council Member', 'School Board Director', 'Water District Director', 'Port Commissioner')
+_measureWords = ('Parks', 'Libraries', 'Roads', 'Schools', 'Fire Protection', 'Transit', 'Water', 'Housing', 'Public Safety', 'Broadband')
+
+# share of contests at each district level
+_stateShare = 0.2
+_countyShare = 0.4
+
+# precincts per city, cities per county
+_precinctsPerCity = 8
+_citiesPerCounty = 6
+
+def _sources(seq, *attypes):
+    return [seq.sourceForType(x) for x in attypes]
+
+def generate(parties=8, contests=60, candidates=5, styles=2000, measures=None, writeIns=True, pageBreaks=True, seed=1):
+    """ElectionReport with `styles` precinct BallotStyles.
+
+    contests: CandidateContests, each with `candidates` candidates
+    measures: BallotMeasureContests (default contests//10)
+    writeIns: a write-in line per vote allowed in each CandidateContest
+    pageBreaks: start ballot measures on a new page
+    """
+    rand = random.Random(seed)
+    if measures is None:
+        measures = contests // 10
+    # fresh counters on the shared type_seq.json scheme so ids don't depend on what else was generated
+    seq = demorace.Sequences()
+    seq.setTypeMap(dict(demorace.typeSequences.attype))
+    party_id, person_id, candidate_id, csel_id, office_id, gpunit_id, ccont_id, bmcont_id, bmsel_id, header_id = _sources(
+        seq,
+        'ElectionResults.Party', 'ElectionResults.Person', 'ElectionResults.Candidate',
+        'ElectionResults.CandidateSelection', 'ElectionResults.Office', 'ElectionResults.ReportingUnit',
+        'ElectionResults.CandidateContest', 'ElectionResults.BallotMeasureContest',
+        'ElectionResults.BallotMeasureSelection', 'ElectionResults.Header')
+
+    partyobs = []
+    for i in range(parties):
+        word = _partyWords[i % len(_partyWords)]
+        if i >= len(_partyWords):
+            word += ' {}'.format(i // len(_partyWords) + 1)
+        partyobs.append({'@id': party_id(), '@type': 'ElectionResults.Party', 'Name': word + ' Party'})
+
+    # districts
+    state = {'@id': gpunit_id(), '@type': 'ElectionResults.ReportingUnit', 'Type': 'state', 'Name': 'Synthetica', 'ComposingGpUnitIds': []}
+    gpunits = [state]
+    counties = []
+    cities = []
+    precincts = []
+    # precinct index -> [state, county, city]
+    districtsOf = []
+    ncities = max(1, -(-styles // _precinctsPerCity))
+    ncounties = max(1, -(-ncities // _citiesPerCounty))
+    for ci in range(ncounties):
+        county = {'@id': gpunit_id(), '@type': 'ElectionResults.ReportingUnit', 'Type': 'county', 'Name': '{} County'.format(_last[ci % len(_last)]) + ('' if ci < len(_last) else ' {}'.format(ci // len(_last) + 1)), 'ComposingGpUnitIds': []}
+        state['ComposingGpUnitIds'].append(county['@id'])
+        counties.append(county)
+        gpunits.append(county)
+    for ti in range(ncities):
+        county = counties[ti // _citiesPerCounty]
+        city = {'@id': gpunit_id(), '@type': 'ElectionResults.ReportingUnit', 'Type': 'city', 'Name': 'City of {} {}'.format(_first[ti % len(_first)], ti + 1), 'ComposingGpUnitIds': []}
+        county['ComposingGpUnitIds'].append(city['@id'])
+        cities.append(city)
+        gpunits.append(city)
+    for pi in range(styles):
+        city = cities[pi // _precinctsPerCity]
+        county = counties[(pi // _precinctsPerCity) // _citiesPerCounty]
+        precinct = {'@id': gpunit_id(), '@type': 'ElectionResults.ReportingUnit', 'Type': 'precinct', 'Name': 'Precinct {:04d}'.format(pi + 1)}
+        city['ComposingGpUnitIds'].append(precinct['@id'])
+        precincts.append(precinct)
+        gpunits.append(precinct)
+        districtsOf.append((state['@id'], county['@id'], city['@id']))
+
+    def district(i, n):
+        # spread contests over levels: statewide, then county, then city
+        if i < max(1, int(n * _stateShare)):
+            return 0, state
+        if i < max(1, int(n * (_stateShare + _countyShare))):
+            return 1, rand.choice(counties)
+        return 2, rand.choice(cities)
+
+    persons = []
+    candobs = []
+    officeobs = []
+    contestobs = []
+    # (level, district id) -> [contest, ...]
+    byDistrict = {}
+    for i in range(contests):
+        level, dist = district(i, contests)
+        office = {'@id': office_id(), '@type': 'ElectionResults.Office', 'Name': '{} {}'.format(dist['Name'], _offices[i % len(_offices)])}
+        officeobs.append(office)
+        votesAllowed = 1 if (candidates < 4 or rand.random() < 0.8) else rand.randint(2, min(3, candidates - 1))
+        sels = []
+        for k in range(candidates):
+            name = '{} {}'.format(rand.choice(_first), rand.choice(_last))
+            person = {'@id': person_id(), '@type': 'ElectionResults.Person', 'FullName': name}
+            if partyobs and level < 2:
+                person['PartyId'] = rand.choice(partyobs)['@id']
+            persons.append(person)
+            cand = {'@id': candidate_id(), '@type': 'ElectionResults.Candidate', 'BallotName': name, 'PersonId': person['@id']}
+            candobs.append(cand)
+            sels.append({'@id': csel_id(), '@type': 'ElectionResults.CandidateSelection', 'CandidateIds': [cand['@id']]})
+        if writeIns:
+            for _ in range(votesAllowed):
+                sels.append({'@id': csel_id(), '@type': 'ElectionResults.CandidateSelection', 'IsWriteIn': True})
+        contest = {
+            '@id': ccont_id(),
+            '@type': 'ElectionResults.CandidateContest',
+            'Name': office['Name'],
+            'ElectionDistrictId': dist['@id'],
+            'VoteVariation': 'plurality' if votesAllowed == 1 else 'n-of-m',
+            'VotesAllowed': votesAllowed,
+            'BallotTitle': office['Name'],
+            'BallotSubTitle': 'Vote for one' if votesAllowed == 1 else 'Vote for up to {}'.format(votesAllowed),
+            'ContestSelection': sels,
+            'NumberElected': votesAllowed,
+            'OfficeIds': [office['@id']],
+        }
+        contestobs.append(contest)
+        byDistrict.setdefault((level, dist['@id']), []).append(contest)
+    measureobs = []
+    for i in range(measures):
+        level, dist = district(i, measures)
+        subject = _measureWords[i % len(_measureWords)]
+        contest = {
+            '@id': bmcont_id(),
+            '@type': 'ElectionResults.BallotMeasureContest',
+            'Name': 'Measure {}'.format(i + 1),
+            'ElectionDistrictId': dist['@id'],
+            'BallotTitle': 'Measure {}: {} Levy'.format(i + 1, subject),
+            'BallotSubTitle': 'Vote Yes or No',
+            'FullText': 'Shall {} levy a tax of ${:.2f} per $1,000 of assessed value for {} for five years?'.format(dist['Name'], rand.randint(10, 150) / 100, subject.lower()),
+            'ContestSelection': [
+                {'@id': bmsel_id(), '@type': 'ElectionResults.BallotMeasureSelection', 'Selection': 'Yes', 'SequenceOrder': 1},
+                {'@id': bmsel_id(), '@type': 'ElectionResults.BallotMeasureSelection', 'Selection': 'No', 'SequenceOrder': 2},
+            ],
+            'Type': 'referendum',
+        }
+        measureobs.append(contest)
+        byDistrict.setdefault((3 + level, dist['@id']), []).append(contest)
+
+    headers = [
+        {'@id': header_id(), '@type': 'ElectionResults.Header', 'Name': 'Instructions'},
+        {'@id': header_id(), '@type': 'ElectionResults.Header', 'Name': 'ColumnBreak'},
+        {'@id': header_id(), '@type': 'ElectionResults.Header', 'Name': 'PageBreak'},
+    ]
+    instructions, columnBreak, pageBreak = [h['@id'] for h in headers]
+
+    bstyles = []
+    for pi, precinct in enumerate(precincts):
+        content = [
+            {'@type': 'ElectionResults.OrderedHeader', 'HeaderId': instructions},
+            {'@type': 'ElectionResults.OrderedHeader', 'HeaderId': columnBreak},
+        ]
+        for level, dist in enumerate(districtsOf[pi]):
+            for co in byDistrict.get((level, dist), ()):
+                # rotate candidate order by precinct, write-ins stay last
+                named = [x['@id'] for x in co['ContestSelection'] if not x.get('IsWriteIn')]
+                writeins = [x['@id'] for x in co['ContestSelection'] if x.get('IsWriteIn')]
+                r = pi % len(named) if named else 0
+                content.append({'@type': 'ElectionResults.OrderedContest', 'ContestId': co['@id'], 'OrderedContestSelectionIds': named[r:] + named[:r] + writeins})
+        mcontent = []
+        for level, dist in enumerate(districtsOf[pi]):
+            for co in byDistrict.get((3 + level, dist), ()):
+                mcontent.append({'@type': 'ElectionResults.OrderedContest', 'ContestId': co['@id']})
+        if mcontent and pageBreaks:
+            content.append({'@type': 'ElectionResults.OrderedHeader', 'HeaderId': pageBreak})
+        content += mcontent
+        bstyles.append({
+            '@type': 'ElectionResults.BallotStyle',
+            'GpUnitIds': [precinct['@id']],
+            'OrderedContent': content,
+            'PageHeader': 'General Election, 2022-11-08\n{}, page {{PAGE}} of {{PAGES}}'.format(precinct['Name']),
+        })
+
+    return {
+        '@type': 'ElectionReport',
+        'Format': 'summary-contest',
+        'GeneratedDate': '2022-09-01T00:00:00+00:00',
+        'Issuer': 'synth',
+        'IssuerAbbreviation': 'synth',
+        'SequenceStart': 1,
+        'SequenceEnd': 1,
+        'Status': 'pre-election',
+        'VendorApplicationId': 'ballotstudio synth',
+        'Election': [{
+            '@type': 'ElectionResults.Election',
+            'Name': 'Synthetic General Election',
+            'Type': 'general',
+            'ElectionScopeId': state['@id'],
+            'StartDate': '2022-11-08',
+            'EndDate': '2022-11-08',
+            'BallotStyle': bstyles,
+            'Candidate': candobs,
+            'Contest': contestobs + measureobs,
+        }],
+        'GpUnit': gpunits,
+        'Header': headers,
+        'Office': officeobs,
+        'Party': partyobs,
+        'Person': persons,
+        'IsTest': True,
+        'TestType': 'pre-election,design',
+    }
+
+def dump(er, out, indent=None):
+    """Write er as JSON to out a piece at a time.
+
+    Ballot styles are encoded one by one so a report with thousands of them
+    is never held as one big string.
+    """
+    if indent is None:
+        enc = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        sep = ','
+    else:
+        enc = json.JSONEncoder(ensure_ascii=False, indent=indent)
+        sep = ',\n'
+    out.write('{')
+    for i, (k, v) in enumerate(er.items()):
+        if i:
+            out.write(sep)
+        out.write(json.dumps(k) + ':')
+        if k != 'Election':
+            for chunk in enc.iterencode(v):
+                out.write(chunk)
+            continue
+        out.write('[')
+        for ei, el in enumerate(v):
+            if ei:
+                out.write(sep)
+            out.write('{')
+            for j, (ek, ev) in enumerate(el.items()):
+                if j:
+                    out.write(sep)
+                out.write(json.dumps(ek) + ':')
+                if ek == 'BallotStyle':
+                    out.write('[')
+                    for si, bs in enumerate(ev):
+                        if si:
+                            out.write(sep)
+                        for chunk in enc.iterencode(bs):
+                            out.write(chunk)
+                    out.write(']')
+                else:
+                    for chunk in enc.iterencode(ev):
+                        out.write(chunk)
+            out.write('}')
+        out.write(']')
+    out.write('}\n')
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description='write a synthetic ElectionReport as JSON')
+    ap.add_argument('--parties', type=int, default=8)
+    ap.add_argument('--contests', type=int, default=60, help='candidate contests')
+    ap.add_argument('--candidates', type=int, default=5, help='candidates per contest')
+    ap.add_argument('--styles', type=int, default=2000, help='precinct ballot styles')
+    ap.add_argument('--measures', type=int, default=None, help='ballot measures (default contests/10)')
+    ap.add_argument('--no-write-ins', dest='writeIns', default=True, action='store_false')
+    ap.add_argument('--no-page-breaks', dest='pageBreaks', default=True, action='store_false')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--indent', type=int, default=None)
+    ap.add_argument('-o', '--out', default='-')
+    args = ap.parse_args()
+    er = generate(args.parties, args.contests, args.candidates, args.styles, args.measures, args.writeIns, args.pageBreaks, args.seed)
+    if args.out == '-':
+        dump(er, sys.stdout, args.indent)
+    else:
+        with open(args.out, 'w') as fout:
+            dump(er, fout, args.indent)
+
+if __name__ == '__main__':
+    main()